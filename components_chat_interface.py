@@ -4,6 +4,7 @@ Streamlitのチャット機能を使用したメッセージ表示と入力処
 マスクアイコンとフリップアニメーション機能を含む
 """
 import streamlit as st
+import itertools
 import logging
 import re
 import uuid
@@ -32,56 +33,82 @@ class ChatInterface:
             memory_summary: メモリサマリー（重要単語から生成）
         """
         try:
-            # 履歴表示の重複実行を防ぐ
-            messages_hash = hash(str(messages))
-            last_render_hash = st.session_state.get('last_chat_render_hash', None)
-            
-            if last_render_hash == messages_hash:
-                logger.debug("チャット履歴表示をスキップ（変更なし）")
-                return
+            # 再実行で出力しない要素は画面から消えるため、履歴は毎回描画する
+            # （メッセージの解析結果は _render_mari_message_with_mask 側でキャッシュ済み）
             
             # メモリサマリーがある場合は表示
             if memory_summary:
                 with st.expander("💭 過去の会話の記憶", expanded=False):
                     st.info(memory_summary)
             
-            # 既存のメッセージを表示
-            for i, message in enumerate(messages):
-                role = message.get("role", "user")
-                content = message.get("content", "")
-                timestamp = message.get("timestamp")
-                is_initial = message.get("is_initial", False)
-                message_id = message.get("message_id", f"msg_{i}")
-                
+            # 連続する同じ役割のメッセージを1つのst.chat_messageにまとめて表示
+            # （初期メッセージは独立したグループとして扱う）
+            debug_mode = st.session_state.get("debug_mode", False)
+            groups = itertools.groupby(
+                enumerate(messages),
+                key=lambda item: (item[1].get("role", "user"), item[1].get("is_initial", False))
+            )
+            for (role, is_initial), group in groups:
+                group = list(group)
                 with st.chat_message(role):
-                    if role == "assistant":
-                        # 麻理のメッセージの場合、隠された真実をチェック
-                        self._render_mari_message_with_mask(message_id, content, is_initial)
+                    if role == "user" and not is_initial and not debug_mode:
+                        # ユーザーメッセージはまとめて1回のst.markdownで描画
+                        st.markdown("\n\n".join(message.get("content", "") for _, message in group))
                     else:
-                        # ユーザーメッセージは通常通り表示
-                        if is_initial:
-                            # 初期メッセージは確実に黒文字で表示
-                            initial_message_html = f'''
-                            <div class="mari-initial-message" style="color: #333333 !important; font-weight: 500;">
-                                {content}
-                            </div>
-                            '''
-                            st.markdown(initial_message_html, unsafe_allow_html=True)
-                        else:
-                            st.markdown(content)
-                    
-                    # デバッグモードの場合はタイムスタンプを表示
-                    if st.session_state.get("debug_mode", False) and timestamp:
-                        st.caption(f"送信時刻: {timestamp}")
+                        for i, message in group:
+                            self._render_message_body(message, i)
             
-            # 履歴表示完了をマーク
-            st.session_state.last_chat_render_hash = messages_hash
             logger.debug(f"チャット履歴表示完了（{len(messages)}件）")
                         
         except Exception as e:
             logger.error(f"チャット履歴表示エラー: {e}")
             st.error("チャット履歴の表示中にエラーが発生しました。")
     
+    def render_message(self, message: Dict[str, str], index: int = 0) -> None:
+        """
+        単一のメッセージを表示する（マスク機能付き）
+        
+        Args:
+            message: チャットメッセージ
+            index: メッセージの位置（message_idがない場合のID生成に使用）
+        """
+        with st.chat_message(message.get("role", "user")):
+            self._render_message_body(message, index)
+    
+    def _render_message_body(self, message: Dict[str, str], index: int) -> None:
+        """
+        メッセージ本文を表示する（st.chat_messageのコンテキスト内で呼び出す）
+        
+        Args:
+            message: チャットメッセージ
+            index: メッセージの位置（message_idがない場合のID生成に使用）
+        """
+        role = message.get("role", "user")
+        content = message.get("content", "")
+        timestamp = message.get("timestamp")
+        is_initial = message.get("is_initial", False)
+        message_id = message.get("message_id", f"msg_{index}")
+        
+        if role == "assistant":
+            # 麻理のメッセージの場合、隠された真実をチェック
+            self._render_mari_message_with_mask(message_id, content, is_initial)
+        else:
+            # ユーザーメッセージは通常通り表示
+            if is_initial:
+                # 初期メッセージは確実に黒文字で表示
+                initial_message_html = f'''
+                <div class="mari-initial-message" style="color: #333333 !important; font-weight: 500;">
+                    {content}
+                </div>
+                '''
+                st.markdown(initial_message_html, unsafe_allow_html=True)
+            else:
+                st.markdown(content)
+        
+        # デバッグモードの場合はタイムスタンプを表示
+        if st.session_state.get("debug_mode", False) and timestamp:
+            st.caption(f"送信時刻: {timestamp}")
+    
     def _render_mari_message_with_mask(self, message_id: str, content: str, is_initial: bool = False) -> None:
         """
         麻理のメッセージをマスク機能付きで表示する
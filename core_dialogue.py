@@ -5,7 +5,7 @@ Together.ai APIを使用した対話生成機能
 import logging
 import os
 import streamlit as st
-from typing import List, Dict, Any, Optional, Tuple
+from typing import List, Dict, Any, Iterator, Optional, Tuple
 from openai import OpenAI
 
 logger = logging.getLogger(__name__)
@@ -129,6 +129,47 @@ class DialogueGenerator:
                 return '{"scene": "none"}'
             return "[HIDDEN:（システムが不調で困ってる...）]…システムの調子が悪いみたい。"
     
+    def call_llm_stream(self, system_prompt: str, user_prompt: str) -> Iterator[str]:
+        """Together.ai APIをストリーミングで呼び出し、応答を受信した順に少しずつ返す"""
+        if not self.client:
+            # デモモード用の固定応答（隠された真実付き）
+            yield "[HIDDEN:（本当は話したいけど...）]は？何それ。あたしに話しかけてるの？"
+            return
+        
+        # 入力検証
+        if not isinstance(system_prompt, str) or not isinstance(user_prompt, str):
+            logger.error(f"プロンプトが文字列ではありません: system={type(system_prompt)}, user={type(user_prompt)}")
+            yield "…なんか変なこと言ってない？"
+            return
+        
+        received = False
+        try:
+            stream = self.client.chat.completions.create(
+                model=self.model,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_prompt}
+                ],
+                temperature=0.8,
+                max_tokens=500,
+                stream=True,
+            )
+            for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    received = True
+                    yield delta
+            
+            if not received:
+                logger.warning("Together.ai API応答が空です")
+                yield "[HIDDEN:（何て言えばいいか分からない...）]…言葉が出てこない。"
+                
+        except Exception as e:
+            logger.error(f"Together.ai APIストリーミング呼び出しエラー: {e}")
+            # 途中まで受信済みの場合はそこで打ち切る
+            if not received:
+                yield "[HIDDEN:（システムが不調で困ってる...）]…システムの調子が悪いみたい。"
+    
     def generate_dialogue(self, history: List[Tuple[str, str]], message: str, 
                          affection: int, stage_name: str, scene_params: Dict[str, Any], 
                          instruction: Optional[str] = None, memory_summary: str = "", 
@@ -145,6 +186,26 @@ class DialogueGenerator:
                                             instruction: Optional[str] = None, memory_summary: str = "", 
                                             use_ura_mode: bool = False) -> str:
         """隠された真実を含む対話を生成する"""
+        return self.call_llm(*self._build_dialogue_prompts(
+            history, message, affection, stage_name, scene_params, 
+            instruction, memory_summary, use_ura_mode
+        ))
+    
+    def generate_dialogue_stream(self, history: List[Tuple[str, str]], message: str, 
+                                 affection: int, stage_name: str, scene_params: Dict[str, Any], 
+                                 instruction: Optional[str] = None, memory_summary: str = "", 
+                                 use_ura_mode: bool = False) -> Iterator[str]:
+        """隠された真実を含む対話をストリーミングで生成する（応答を受信した順に返す）"""
+        return self.call_llm_stream(*self._build_dialogue_prompts(
+            history, message, affection, stage_name, scene_params, 
+            instruction, memory_summary, use_ura_mode
+        ))
+    
+    def _build_dialogue_prompts(self, history: List[Tuple[str, str]], message: str, 
+                                affection: int, stage_name: str, scene_params: Dict[str, Any], 
+                                instruction: Optional[str] = None, memory_summary: str = "", 
+                                use_ura_mode: bool = False) -> Tuple[str, str]:
+        """対話生成用の (システムプロンプト, ユーザープロンプト) を構築する"""
         if not isinstance(history, list):
             history = []
         if not isinstance(scene_params, dict):
@@ -179,7 +240,7 @@ class DialogueGenerator:
 
 {f"指示: {instruction}" if instruction else f"「{message}」に応答:"}'''
         
-        return self.call_llm(hidden_system_prompt, user_prompt)
+        return hidden_system_prompt, user_prompt
     
     def should_generate_hidden_content(self, affection: int, message_count: int) -> bool:
         """隠された真実を生成すべきかどうかを判定する"""
@@ -2,6 +2,7 @@
 メモリ管理モジュール
 会話履歴から重要単語を抽出し、トークン使用量を最適化する
 """
+import itertools
 import logging
 import re
 from typing import List, Dict, Tuple, Any
@@ -10,6 +11,41 @@ import json
 
 logger = logging.getLogger(__name__)
 
+# ストップワード（抽出対象から除外する語）
+_STOP_WORDS = frozenset({
+    'の', 'に', 'は', 'を', 'が', 'で', 'と', 'から', 'まで', 'より',
+    'だ', 'である', 'です', 'ます', 'した', 'する', 'される',
+    'これ', 'それ', 'あれ', 'この', 'その', 'あの',
+    'ここ', 'そこ', 'あそこ', 'どこ', 'いつ', 'なに', 'なぜ',
+    'ちょっと', 'とても', 'すごく', 'かなり', 'もう', 'まだ',
+    'でも', 'しかし', 'だから', 'そして', 'また', 'さらに',
+    'あたし', 'お前', 'ユーザー', 'システム', 'アプリ'
+})
+
+# 重要カテゴリのキーワード
+_IMPORTANT_CATEGORIES = {
+    'food': ('コーヒー', 'お茶', '紅茶', 'ケーキ', 'パン', '料理', '食べ物', '飲み物'),
+    'hobby': ('読書', '映画', '音楽', 'ゲーム', 'スポーツ', '散歩', '旅行'),
+    'emotion': ('嬉しい', '悲しい', '楽しい', '怒り', '不安', '安心', '幸せ'),
+    'place': ('家', '学校', '会社', '公園', 'カフェ', '図書館', '駅', '街'),
+    'time': ('朝', '昼', '夜', '今日', '明日', '昨日', '週末', '平日'),
+    'color': ('赤', '青', '緑', '黄色', '白', '黒', 'ピンク', '紫'),
+    'weather': ('晴れ', '雨', '曇り', '雪', '暑い', '寒い', '暖かい', '涼しい'),
+}
+
+# 全カテゴリのキーワードを宣言順に並べたもの（検出用。順位の同点時の並びを実行ごとに変えないため、集合ではなくタプルを走査する）
+_IMPORTANT_KEYWORDS = tuple(dict.fromkeys(itertools.chain.from_iterable(_IMPORTANT_CATEGORIES.values())))
+
+# 全カテゴリのキーワードの集合（重要度スコア計算時の所属判定用）
+_IMPORTANT_SET = frozenset(_IMPORTANT_KEYWORDS)
+
+# 重要そうなパターン（いずれも数字のみの語には一致しない）
+_IMPORTANT_PATTERNS = (
+    re.compile(r'[A-Za-z]{3,}'),  # 英単語（3文字以上）
+    re.compile(r'[ァ-ヶー]{2,}'),  # カタカナ（2文字以上）
+    re.compile(r'[一-龯]{2,}'),   # 漢字（2文字以上）
+)
+
 class MemoryManager:
     """会話履歴のメモリ管理を行うクラス"""
     
@@ -34,23 +70,11 @@ class MemoryManager:
         Returns:
             重要単語のリスト
         """
-        try:
-            # メッセージからテキストを結合
-            text_content = []
-            for msg in messages:
-                if msg.get("content"):
-                    text_content.append(msg["content"])
-            
-            combined_text = " ".join(text_content)
-            
-            # ルールベースの抽出のみ使用
-            return self._extract_with_rules(combined_text)
-            
-        except Exception as e:
-            logger.error(f"重要単語抽出エラー: {e}")
-            return self._extract_with_rules(" ".join([msg.get("content", "") for msg in messages]))
-    
-
+        # メッセージからテキストを結合
+        combined_text = " ".join(msg["content"] for msg in messages if msg.get("content"))
+        
+        # ルールベースの抽出のみ使用
+        return self._extract_with_rules(combined_text)
     
     def _extract_with_rules(self, text: str) -> List[str]:
         """
@@ -62,83 +86,27 @@ class MemoryManager:
         Returns:
             重要単語のリスト
         """
-        try:
-            # 基本的なクリーニング
-            text = re.sub(r'[^\w\s]', ' ', text)
-            words = text.split()
-            
-            # ストップワードを除外
-            stop_words = {
-                'の', 'に', 'は', 'を', 'が', 'で', 'と', 'から', 'まで', 'より',
-                'だ', 'である', 'です', 'ます', 'した', 'する', 'される',
-                'これ', 'それ', 'あれ', 'この', 'その', 'あの',
-                'ここ', 'そこ', 'あそこ', 'どこ', 'いつ', 'なに', 'なぜ',
-                'ちょっと', 'とても', 'すごく', 'かなり', 'もう', 'まだ',
-                'でも', 'しかし', 'だから', 'そして', 'また', 'さらに',
-                'あたし', 'お前', 'ユーザー', 'システム', 'アプリ'
-            }
-            
-            # 重要カテゴリのキーワード
-            important_categories = {
-                'food': ['コーヒー', 'お茶', '紅茶', 'ケーキ', 'パン', '料理', '食べ物', '飲み物'],
-                'hobby': ['読書', '映画', '音楽', 'ゲーム', 'スポーツ', '散歩', '旅行'],
-                'emotion': ['嬉しい', '悲しい', '楽しい', '怒り', '不安', '安心', '幸せ'],
-                'place': ['家', '学校', '会社', '公園', 'カフェ', '図書館', '駅', '街'],
-                'time': ['朝', '昼', '夜', '今日', '明日', '昨日', '週末', '平日'],
-                'color': ['赤', '青', '緑', '黄色', '白', '黒', 'ピンク', '紫'],
-                'weather': ['晴れ', '雨', '曇り', '雪', '暑い', '寒い', '暖かい', '涼しい']
-            }
-            
-            # 重要そうなパターンを優先
-            important_patterns = [
-                r'[A-Za-z]{3,}',  # 英単語（3文字以上）
-                r'[ァ-ヶー]{2,}',  # カタカナ（2文字以上）
-                r'[一-龯]{2,}',   # 漢字（2文字以上）
-            ]
-            
-            important_words = []
-            
-            # パターンマッチング
-            for pattern in important_patterns:
-                matches = re.findall(pattern, text)
-                important_words.extend(matches)
-            
-            # カテゴリ別重要語句の検出
-            for category, keywords in important_categories.items():
-                for keyword in keywords:
-                    if keyword in text:
-                        important_words.append(keyword)
-            
-            # 頻度でフィルタリング
-            word_counts = Counter(important_words)
-            filtered_words = []
-            
-            for word, count in word_counts.items():
-                if (len(word) >= 2 and 
-                    word not in stop_words and 
-                    not word.isdigit() and  # 数字のみは除外
-                    count >= 1):  # 最低1回は出現
-                    filtered_words.append(word)
-            
-            # 重要度でソート（頻度 + カテゴリ重要度）
-            def get_importance_score(word):
-                base_score = word_counts[word]
-                # カテゴリに含まれる語句は重要度アップ
-                for keywords in important_categories.values():
-                    if word in keywords:
-                        base_score += 2
-                # 長い語句は重要度アップ
-                if len(word) >= 4:
-                    base_score += 1
-                return base_score
-            
-            # 重要度順でソートして上位15個を返す
-            sorted_words = sorted(filtered_words, key=get_importance_score, reverse=True)
-            return sorted_words[:15]
-            
-        except Exception as e:
-            logger.error(f"ルールベース抽出エラー: {e}")
+        if not text:
             return []
+        
+        # 基本的なクリーニング
+        text = re.sub(r'[^\w\s]', ' ', text)
+        
+        # パターンマッチングとカテゴリ別重要語句の検出を中間リストなしで集計
+        word_counts = Counter(itertools.chain(
+            (m.group() for pattern in _IMPORTANT_PATTERNS for m in pattern.finditer(text)),
+            (keyword for keyword in _IMPORTANT_KEYWORDS if keyword in text)
+        ))
+        
+        # 頻度でフィルタリングしつつ重要度を計算（頻度 + カテゴリ重要度 + 長さ）
+        scored = {
+            word: count + (2 if word in _IMPORTANT_SET else 0) + (1 if len(word) >= 4 else 0)
+            for word, count in word_counts.items()
+            if len(word) >= 2 and word not in _STOP_WORDS
+        }
+        
+        # 重要度順で上位15個を返す
+        return [word for word, _ in Counter(scored).most_common(15)]
     
     def should_compress_history(self, messages: List[Dict[str, str]]) -> bool:
         """
@@ -166,32 +134,27 @@ class MemoryManager:
         Returns:
             (圧縮後のメッセージリスト, 抽出された重要単語のリスト)
         """
-        try:
-            if not self.should_compress_history(messages):
-                return messages, self.important_words_cache
-            
-            # 最新の数ターンを保持
-            keep_recent = 4  # 最新4ターン（ユーザー2回、アシスタント2回）を保持
-            
-            # 古い履歴から重要単語を抽出
-            old_messages = messages[:-keep_recent] if len(messages) > keep_recent else []
-            recent_messages = messages[-keep_recent:] if len(messages) > keep_recent else messages
-            
-            if old_messages:
-                # 重要単語を抽出
-                new_keywords = self.extract_important_words(old_messages, dialogue_generator)
-                
-                # 既存のキーワードと統合（重複除去）
-                all_keywords = list(set(self.important_words_cache + new_keywords))
-                self.important_words_cache = all_keywords[:20]  # 最大20個のキーワードを保持
-                
-                logger.info(f"履歴を圧縮しました。抽出されたキーワード: {new_keywords}")
+        if not self.should_compress_history(messages):
+            return messages, self.important_words_cache
+        
+        # 最新の数ターンを保持
+        keep_recent = 4  # 最新4ターン（ユーザー2回、アシスタント2回）を保持
+        
+        # 古い履歴から重要単語を抽出
+        old_messages = messages[:-keep_recent] if len(messages) > keep_recent else []
+        recent_messages = messages[-keep_recent:] if len(messages) > keep_recent else messages
+        
+        if old_messages:
+            # 重要単語を抽出
+            new_keywords = self.extract_important_words(old_messages, dialogue_generator)
             
-            return recent_messages, self.important_words_cache
+            # 既存のキーワードと統合（重複除去）
+            all_keywords = list(set(self.important_words_cache + new_keywords))
+            self.important_words_cache = all_keywords[:20]  # 最大20個のキーワードを保持
             
-        except Exception as e:
-            logger.error(f"履歴圧縮エラー: {e}")
-            return messages, self.important_words_cache
+            logger.info(f"履歴を圧縮しました。抽出されたキーワード: {new_keywords}")
+        
+        return recent_messages, self.important_words_cache
     
     def get_memory_summary(self) -> str:
         """
@@ -34,28 +34,36 @@ class RateLimiter:
             return False  # ブロック状態を示すためにFalseを返す
         
         now = time.time()
-        timestamps = limiter_state.get("timestamps", [])
+        timestamps = limiter_state.get("timestamps")
         if not isinstance(timestamps, list):
             timestamps = []
             limiter_state["timestamps"] = timestamps
         
-        # 時間窓外のタイムスタンプを削除
-        limiter_state["timestamps"] = [
-            t for t in timestamps if now - t < self.time_window
-        ]
+        # 時間窓外のタイムスタンプを先頭からその場で削除（古い順に並んでいるため）
+        expired = 0
+        for t in timestamps:
+            if now - t < self.time_window:
+                break
+            expired += 1
+        del timestamps[:expired]
         
         # リクエスト数が上限を超えているかチェック
-        if len(limiter_state["timestamps"]) >= self.max_requests:
+        if len(timestamps) >= self.max_requests:
             logger.warning("レートリミット超過")
             limiter_state["is_blocked"] = True
             return False
         
         # 新しいリクエストのタイムスタンプを追加
-        limiter_state["timestamps"].append(now)
+        timestamps.append(now)
         return True
     
     def reset_limiter(self, limiter_state: Dict[str, Any]):
         """レートリミッターをリセットする"""
         if isinstance(limiter_state, dict):
-            limiter_state["timestamps"] = []
+            # 既存の状態オブジェクトをその場で初期化して再利用する
+            timestamps = limiter_state.get("timestamps")
+            if isinstance(timestamps, list):
+                timestamps.clear()
+            else:
+                limiter_state["timestamps"] = []
             limiter_state["is_blocked"] = False
\ No newline at end of file
@@ -2,15 +2,58 @@
 シーン管理モジュール
 背景テーマの管理とシーン変更の検出（Groq API使用）
 """
+import asyncio
+import functools
 import json
 import logging
 import os
+import re
+import time
 from typing import Dict, Any, Optional, List, Tuple
-from datetime import datetime
-from groq import Groq
+from groq import AsyncGroq
 
 logger = logging.getLogger(__name__)
 
+# 場所関連キーワード（シーン検出の事前フィルタ用）
+_LOCATION_KEYWORDS = (
+    # 場所名
+    "ビーチ", "海", "砂浜", "海岸", "海辺", "浜辺",
+    "神社", "お寺", "寺院", "鳥居", "境内",
+    "カフェ", "喫茶店", "店", "レストラン",
+    "祭り", "花火", "屋台", "縁日",
+    "部屋", "家", "室内", "寝室", "リビング",
+    "水族館", "アクアリウム",
+    # 移動動詞
+    "行く", "行こう", "向かう", "着いた", "到着", "移動", "出かける", "来た", "いる", "にいる",
+    # 場所の特徴
+    "夕日", "夕焼け", "サンセット", "波", "潮風",
+    "お参り", "参拝", "祈り", "おみくじ",
+    "コーヒー", "お茶", "ラテ", "エスプレッソ",
+    "浴衣", "夜店", "お祭り", "フェスティバル",
+    "ベッド", "夜", "屋内", "家の中",
+    "魚", "水槽", "イルカ", "クラゲ", "海の生き物"
+)
+# 長いキーワードを優先する単一の正規表現に事前コンパイル
+_LOCATION_RE = re.compile(
+    "|".join(re.escape(kw) for kw in sorted(_LOCATION_KEYWORDS, key=len, reverse=True))
+)
+
+
+@functools.lru_cache(maxsize=1)
+def _get_async_groq(api_key: str, loop: asyncio.AbstractEventLoop) -> Optional[AsyncGroq]:
+    """
+    イベントループ単位で共有するAsyncGroqクライアントを取得する（接続を再利用）
+    httpxの接続プールは作成時のループに結び付くため、ループが変わった場合は作り直す
+    """
+    try:
+        client = AsyncGroq(api_key=api_key)
+        logger.info("Groq APIクライアントの初期化が完了しました。")
+        return client
+    except Exception as e:
+        logger.error(f"Groq APIクライアントの初期化に失敗しました: {e}")
+        return None
+
+
 class SceneManager:
     """シーン管理を担当するクラス（Groq API使用）"""
     
@@ -24,22 +67,30 @@ class SceneManager:
             "cafe_afternoon": "https://images.unsplash.com/photo-1554118811-1e0d58224f24?w=1200&h=800&fit=crop",
             "aquarium_night": "https://images.unsplash.com/photo-1544551763-46a013bb70d5?w=1200&h=800&fit=crop"
         }
-        self.groq_client = self._initialize_groq_client()
+        # シーン検出プロンプト用の定数（呼び出し毎に再構築しないよう事前計算）
+        self._scenes_description = {
+            "default": "デフォルトの部屋",
+            "room_night": "夜の部屋・寝室",
+            "beach_sunset": "夕日のビーチ・海岸",
+            "festival_night": "夜祭り・花火大会",
+            "shrine_day": "昼間の神社・寺院",
+            "cafe_afternoon": "午後のカフェ・喫茶店",
+            "aquarium_night": "夜の水族館"
+        }
+        self._available_scenes = frozenset(self.theme_urls)
+        self._scenes_prompt_fragment = "\n".join(
+            f"- {scene}: {desc}" for scene, desc in self._scenes_description.items()
+        )
+        self._groq_api_key = os.getenv("GROQ_API_KEY")
+        if not self._groq_api_key:
+            logger.warning("環境変数 GROQ_API_KEY が設定されていません。シーン検出機能が制限されます。")
     
-    def _initialize_groq_client(self):
-        """Groq APIクライアントの初期化"""
-        try:
-            api_key = os.getenv("GROQ_API_KEY")
-            if not api_key:
-                logger.warning("環境変数 GROQ_API_KEY が設定されていません。シーン検出機能が制限されます。")
-                return None
-            
-            client = Groq(api_key=api_key)
-            logger.info("Groq APIクライアントの初期化が完了しました。")
-            return client
-        except Exception as e:
-            logger.error(f"Groq APIクライアントの初期化に失敗しました: {e}")
+    @property
+    def groq_client(self) -> Optional[AsyncGroq]:
+        """実行中のイベントループに対応する共有Groq APIクライアント（非同期処理の中でのみ使用する）"""
+        if not self._groq_api_key:
             return None
+        return _get_async_groq(self._groq_api_key, asyncio.get_running_loop())
     
     def get_theme_url(self, theme: str) -> str:
         """テーマに対応するURLを取得する"""
@@ -49,7 +100,7 @@ class SceneManager:
         """利用可能なテーマのリストを取得する"""
         return list(self.theme_urls.keys())
     
-    def detect_scene_change(self, history: List[Tuple[str, str]], 
+    async def detect_scene_change(self, history: List[Tuple[str, str]], 
                            dialogue_generator=None, current_theme: str = "default") -> Optional[str]:
         """
         会話履歴からシーン変更を検出する（Groq API使用）
@@ -66,23 +117,25 @@ class SceneManager:
             logger.info("履歴が空のためシーン検出をスキップ")
             return None
             
-        if not self.groq_client:
+        groq_client = self.groq_client
+        if not groq_client:
             logger.warning("Groq APIクライアントが初期化されていません")
             return None
         
         # 最新5件の会話履歴を使用（より多くの文脈を提供）
         recent_history = history[-5:] if len(history) > 5 else history
-        history_text = "\n".join([
-            f"ユーザー: {u}\n麻理: {m}" for u, m in recent_history
-        ])
         
-        # 事前フィルタリング: 場所に関連するキーワードがあるかチェック
-        if not self._has_location_keywords(history_text):
+        # 事前フィルタリング: 履歴を結合する前に場所に関連するキーワードがあるかチェック
+        if not any(_LOCATION_RE.search(u) or _LOCATION_RE.search(m) for u, m in recent_history):
             logger.info("場所関連のキーワードが見つからないためシーン検出をスキップ")
             return None
         
+        history_text = "\n".join([
+            f"ユーザー: {u}\n麻理: {m}" for u, m in recent_history
+        ])
+        
         # Groq APIを使用してシーン変更を検出
-        return self._detect_scene_with_groq(history_text, current_theme)
+        return await self._detect_scene_with_groq(history_text, current_theme)
     
     def _has_location_keywords(self, text: str) -> bool:
         """
@@ -94,33 +147,14 @@ class SceneManager:
         Returns:
             場所関連キーワードが含まれているかどうか
         """
-        location_keywords = [
-            # 場所名
-            "ビーチ", "海", "砂浜", "海岸", "海辺", "浜辺",
-            "神社", "お寺", "寺院", "鳥居", "境内",
-            "カフェ", "喫茶店", "店", "レストラン",
-            "祭り", "花火", "屋台", "縁日",
-            "部屋", "家", "室内", "寝室", "リビング",
-            "水族館", "アクアリウム",
-            # 移動動詞
-            "行く", "行こう", "向かう", "着いた", "到着", "移動", "出かける", "来た", "いる", "にいる",
-            # 場所の特徴
-            "夕日", "夕焼け", "サンセット", "波", "潮風",
-            "お参り", "参拝", "祈り", "おみくじ",
-            "コーヒー", "お茶", "ラテ", "エスプレッソ",
-            "浴衣", "夜店", "お祭り", "フェスティバル",
-            "ベッド", "夜", "屋内", "家の中",
-            "魚", "水槽", "イルカ", "クラゲ", "海の生き物"
-        ]
-        
-        for keyword in location_keywords:
-            if keyword in text:
-                logger.info(f"場所関連キーワードを検出: {keyword}")
-                return True
+        match = _LOCATION_RE.search(text)
+        if match:
+            logger.info(f"場所関連キーワードを検出: {match.group()}")
+            return True
         
         return False
     
-    def _detect_scene_with_groq(self, history_text: str, current_theme: str) -> Optional[str]:
+    async def _detect_scene_with_groq(self, history_text: str, current_theme: str) -> Optional[str]:
         """
         Groq APIを使用してシーン変更を検出する
         
@@ -131,25 +165,12 @@ class SceneManager:
         Returns:
             新しいシーン名（変更がない場合はNone）
         """
-        try:
-            # デバッグログ
-            logger.info(f"シーン検出開始 - 現在のテーマ: {current_theme}")
-            logger.info(f"会話履歴: {history_text}")
-            
-            # 利用可能なシーンのリスト
-            available_scenes = list(self.theme_urls.keys())
-            scenes_description = {
-                "default": "デフォルトの部屋",
-                "room_night": "夜の部屋・寝室",
-                "beach_sunset": "夕日のビーチ・海岸",
-                "festival_night": "夜祭り・花火大会",
-                "shrine_day": "昼間の神社・寺院",
-                "cafe_afternoon": "午後のカフェ・喫茶店",
-                "aquarium_night": "夜の水族館"
-            }
-            
-            # より積極的なシーン検出のためのプロンプト
-            system_prompt = """あなたは会話の内容から、キャラクターとユーザーの現在位置（シーン）を判定する専門システムです。
+        # デバッグログ
+        logger.info(f"シーン検出開始 - 現在のテーマ: {current_theme}")
+        logger.info(f"会話履歴: {history_text}")
+        
+        # より積極的なシーン検出のためのプロンプト
+        system_prompt = """あなたは会話の内容から、キャラクターとユーザーの現在位置（シーン）を判定する専門システムです。
 
 会話履歴を分析し、場所の移動や新しい場所への言及があったかを判断してください。
 
@@ -163,20 +184,25 @@ class SceneManager:
 {"scene": "シーン名", "confidence": "high/medium/low", "reason": "判定理由"} または {"scene": "none", "confidence": "high", "reason": "判定理由"}
 
 重要: JSON以外の文字は一切出力しないでください。"""
-            
-            user_prompt = f"""現在のシーン: {current_theme} ({scenes_description.get(current_theme, current_theme)})
+        
+        user_prompt = f"""現在のシーン: {current_theme} ({self._scenes_description.get(current_theme, current_theme)})
 
 利用可能なシーン:
-{chr(10).join([f"- {scene}: {desc}" for scene, desc in scenes_description.items()])}
+{self._scenes_prompt_fragment}
 
 会話履歴:
 {history_text}
 
 この会話で場所の移動や新しい場所への言及があった場合は、最も適切なシーン名を返してください。
 判定の理由も含めて回答してください。"""
-            
-            # Groq APIを呼び出し
-            response = self.groq_client.chat.completions.create(
+        
+        # 実行中のイベントループに対応するクライアントで Groq APIを呼び出し
+        groq_client = self.groq_client
+        if not groq_client:
+            logger.warning("Groq APIクライアントが初期化されていません")
+            return None
+        try:
+            response = await groq_client.chat.completions.create(
                 model="compound-beta",
                 messages=[
                     {"role": "system", "content": system_prompt},
@@ -186,41 +212,46 @@ class SceneManager:
                 max_tokens=150,   # トークン数を増やす
                 response_format={"type": "json_object"}
             )
-            
-            if not response.choices or not response.choices[0].message.content:
-                logger.warning("Groq APIからの応答が空です")
-                return None
-            
-            # デバッグ: API応答をログ出力
-            api_response = response.choices[0].message.content
-            logger.info(f"Groq API応答: {api_response}")
-            
-            # JSONをパース
-            result = json.loads(api_response)
-            scene_value = result.get("scene", "none")
-            confidence = result.get("confidence", "unknown")
-            reason = result.get("reason", "理由不明")
-            
-            logger.info(f"シーン検出結果: {scene_value}, 信頼度: {confidence}, 理由: {reason}")
-            
-            # 結果を検証
-            if (isinstance(scene_value, str) and 
-                scene_value != "none" and 
-                scene_value in available_scenes and 
-                scene_value != current_theme):
-                logger.info(f"Groqでシーン変更を検出: {current_theme} → {scene_value} (理由: {reason})")
-                return scene_value
-            
-            logger.info(f"シーン変更なし: {reason}")
+        except Exception as e:
+            logger.error(f"Groq APIシーン検出エラー: {e}")
             return None
-            
+        
+        if not response.choices or not response.choices[0].message.content:
+            logger.warning("Groq APIからの応答が空です")
+            return None
+        
+        # デバッグ: API応答をログ出力
+        api_response = response.choices[0].message.content
+        logger.info(f"Groq API応答: {api_response}")
+        
+        # JSONをパース
+        try:
+            result = json.loads(api_response)
         except json.JSONDecodeError as e:
             logger.error(f"Groq APIのJSON応答パースエラー: {e}")
-            logger.error(f"応答内容: {response.choices[0].message.content if response.choices else 'None'}")
+            logger.error(f"応答内容: {api_response}")
             return None
-        except Exception as e:
-            logger.error(f"Groq APIシーン検出エラー: {e}")
+        
+        if not isinstance(result, dict):
+            logger.warning(f"Groq APIの応答形式が不正です: {api_response}")
             return None
+        
+        scene_value = result.get("scene", "none")
+        confidence = result.get("confidence", "unknown")
+        reason = result.get("reason", "理由不明")
+        
+        logger.info(f"シーン検出結果: {scene_value}, 信頼度: {confidence}, 理由: {reason}")
+        
+        # 結果を検証
+        if (isinstance(scene_value, str) and 
+            scene_value != "none" and 
+            scene_value in self._available_scenes and 
+            scene_value != current_theme):
+            logger.info(f"Groqでシーン変更を検出: {current_theme} → {scene_value} (理由: {reason})")
+            return scene_value
+        
+        logger.info(f"シーン変更なし: {reason}")
+        return None
     
     def create_scene_params(self, theme: str = "default") -> Dict[str, Any]:
         """シーンパラメータを作成する"""
@@ -232,10 +263,11 @@ class SceneManager:
         if not isinstance(scene_params, dict):
             scene_params = self.create_scene_params()
         
-        updated_params = scene_params.copy()
-        updated_params["theme"] = new_theme
-        updated_params["last_updated"] = json.dumps(datetime.now().isoformat())
-        return updated_params
+        # 呼び出し側は戻り値で上書きするため、コピーせずにその場で更新する
+        scene_params["theme"] = new_theme
+        # 表示が必要な場合のみ整形できるよう、UNIXタイムスタンプ（float）で保持
+        scene_params["last_updated"] = time.time()
+        return scene_params
     
     def should_update_background(self, scene_params: Dict[str, Any], 
                                 current_display_theme: str) -> bool:
@@ -281,7 +313,7 @@ class SceneManager:
         
         return f"シーンが「{old_name}」から「{new_name}」に変更されました"
     
-    def test_scene_detection(self, test_message: str, current_theme: str = "default") -> Optional[str]:
+    async def test_scene_detection(self, test_message: str, current_theme: str = "default") -> Optional[str]:
         """
         シーン検出のテスト用メソッド
         
@@ -302,7 +334,7 @@ class SceneManager:
             logger.info("場所関連キーワードなし")
             return None
         
-        return self._detect_scene_with_groq(history_text, current_theme)
+        return await self._detect_scene_with_groq(history_text, current_theme)
     
     def get_debug_info(self) -> Dict[str, Any]:
         """
@@ -312,7 +344,7 @@ class SceneManager:
             デバッグ情報の辞書
         """
         return {
-            "groq_client_initialized": self.groq_client is not None,
+            "groq_client_initialized": bool(self._groq_api_key),
             "available_themes": list(self.theme_urls.keys()),
             "theme_count": len(self.theme_urls)
         }
\ No newline at end of file
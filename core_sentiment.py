@@ -7,6 +7,22 @@ from typing import Optional
 
 logger = logging.getLogger(__name__)
 
+def _stage_for(affection) -> str:
+    """好感度から関係性のステージ名を決定する"""
+    if affection < 20:
+        return "ステージ1：敵対"
+    elif affection < 40:
+        return "ステージ2：中立"
+    elif affection < 60:
+        return "ステージ3：好意"
+    elif affection < 80:
+        return "ステージ4：親密"
+    else:
+        return "ステージ5：最接近"
+
+# 好感度（0〜100の整数）→ 関係性ステージの早見表（起動時に一度だけ作成）
+_STAGE_BY_AFFECTION = tuple(_stage_for(i) for i in range(101))
+
 class SentimentAnalyzer:
     """感情分析を担当するクラス"""
     
@@ -183,13 +199,7 @@ class SentimentAnalyzer:
         if not isinstance(affection, (int, float)):
             affection = 30  # デフォルト値
         
-        if affection < 20:
-            return "ステージ1：敵対"
-        elif affection < 40:
-            return "ステージ2：中立"
-        elif affection < 60:
-            return "ステージ3：好意"
-        elif affection < 80:
-            return "ステージ4：親密"
-        else:
-            return "ステージ5：最接近"
\ No newline at end of file
+        # 通常の好感度（0〜100の整数）は早見表から取得
+        if isinstance(affection, int) and 0 <= affection <= 100:
+            return _STAGE_BY_AFFECTION[affection]
+        return _stage_for(affection)
\ No newline at end of file
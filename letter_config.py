@@ -23,6 +23,8 @@ class Config:
     # --- モード設定 ---
     # デバッグモード (trueにすると一部ログの出力先がコンソールのみになります)
     DEBUG_MODE: bool = os.getenv("DEBUG_MODE", "false").lower() == "true"
+    # セッションを毎回強制リセットするか（開発用）
+    FORCE_SESSION_RESET: bool = os.getenv("FORCE_SESSION_RESET", "false").lower() == "true"
 
     # --- バッチ処理設定 ---
     # 手紙を生成する時刻のリスト（深夜2時、3時、4時）
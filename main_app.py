@@ -2,19 +2,35 @@
 麻理チャット＆手紙生成 統合アプリケーション
 """
 import streamlit as st
+import atexit
+import bisect
+import itertools
 import logging
 import os
+import socket
 import asyncio
 import sys
+import threading
 import time
-from datetime import datetime
+import requests
 from dotenv import load_dotenv
+from collections import deque
+from collections.abc import Mapping
 from contextlib import contextmanager
+from types import SimpleNamespace
+
+try:
+    import uvicorn
+except ImportError:  # 開発環境ではセッション管理サーバーなしで動作させる
+    uvicorn = None
 
 # --- 基本設定 ---
+_IS_WINDOWS = sys.platform.startswith('win')
+
 # 非同期処理の問題を解決 (Windows向け)
-if sys.platform.startswith('win'):
-    asyncio.set_event_loop_policy(asyncio.WindowsProactorEventLoopPolicy())
+# HTTP呼び出しのみでサブプロセスは使わないため、スレッドから扱いやすいSelectorループを使う
+if _IS_WINDOWS:
+    asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
 
 # .envファイルから環境変数を読み込み
 load_dotenv()
@@ -24,73 +40,114 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 logger = logging.getLogger(__name__)
 
 # --- セッション管理サーバー自動起動 ---
+@st.cache_resource
+def _session_server_endpoint() -> dict:
+    """接続に成功したセッション管理サーバーのホストを全セッションで共有する"""
+    return {}
+
+def _port_open(host: str, port: int, timeout: float = 0.1) -> bool:
+    """指定したホストとポートでTCP接続を受け付けているかを確認する"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        return sock.connect_ex((host, port)) == 0
+
+@st.cache_resource
+def _health_check_session() -> requests.Session:
+    """ヘルスチェック用のHTTPセッション（接続を使い回すため全セッションで共有）"""
+    return requests.Session()
+
+def _run_session_server():
+    """バックグラウンドでサーバーを起動"""
+    try:
+        logger.info("セッション管理サーバーをバックグラウンドで起動中...")
+        
+        # uvicornでサーバー起動（Hugging Face Spaces対応）
+        if uvicorn is None:
+            logger.warning("uvicornがインストールされていないため、セッション管理サーバーを起動できません")
+            return
+        
+        # 実行環境に応じてホストを決定
+        is_spaces = os.getenv("SPACE_ID") is not None
+        host = "0.0.0.0" if is_spaces else "127.0.0.1"
+        
+        uvicorn.run(
+            "session_api_server:app",
+            host=host,
+            port=8000,
+            log_level="warning",  # ログレベルを下げてStreamlitログと混在を防ぐ
+            access_log=False      # アクセスログを無効化
+        )
+    except Exception as e:
+        logger.error(f"サーバー起動エラー: {e}")
+
+@st.cache_resource
+def _session_server_thread() -> threading.Thread:
+    """セッション管理サーバーのスレッドを起動する（プロセス内で一度だけ）"""
+    server_thread = threading.Thread(target=_run_session_server, daemon=True)
+    server_thread.start()
+    return server_thread
+
 def start_session_server():
     """
     セッション管理サーバーを自動起動する
     Hugging Face Spacesでの実行時に必要
     """
-    import subprocess
-    import threading
-    import requests
-    import time
-    
-    def check_server_running(timeout=2):
-        """サーバーが起動しているかチェック"""
-        # Hugging Face Spacesでの実行を考慮してホストを動的に決定
-        hosts_to_try = ["127.0.0.1", "localhost", "0.0.0.0"]
-        port = 8000
-        
-        for host in hosts_to_try:
-            try:
-                response = requests.get(f"http://{host}:{port}/health", timeout=timeout)
-                if response.status_code == 200:
-                    logger.debug(f"サーバー接続成功: {host}:{port}")
-                    return True
-            except Exception:
-                continue
-        return False
-    
-    def run_server():
-        """バックグラウンドでサーバーを起動"""
+    port = 8000
+    # uvicornは127.0.0.1で待ち受ける（Spacesでも0.0.0.0なので127.0.0.1から到達できる）
+    primary_host = "127.0.0.1"
+    fallback_hosts = ("localhost", "0.0.0.0")
+    endpoint = _session_server_endpoint()
+    http = _health_check_session()
+    
+    def check_server_running(host=primary_host, timeout=0.2):
+        """サーバーが起動しているかチェック（ローカルなので短いタイムアウトで十分）"""
+        # 待ち受け前はHTTPを組み立てず、ソケット接続だけで素早く判定する
+        if not _port_open(host, port):
+            return False
         try:
-            logger.info("セッション管理サーバーをバックグラウンドで起動中...")
-            
-            # uvicornでサーバー起動（Hugging Face Spaces対応）
-            import uvicorn
-            
-            # 実行環境に応じてホストを決定
-            is_spaces = os.getenv("SPACE_ID") is not None
-            host = "0.0.0.0" if is_spaces else "127.0.0.1"
-            
-            uvicorn.run(
-                "session_api_server:app",
-                host=host,
-                port=8000,
-                log_level="warning",  # ログレベルを下げてStreamlitログと混在を防ぐ
-                access_log=False      # アクセスログを無効化
-            )
-        except Exception as e:
-            logger.error(f"サーバー起動エラー: {e}")
+            response = http.get(f"http://{host}:{port}/health", timeout=timeout)
+            if response.status_code == 200:
+                logger.debug("サーバー接続成功: %s:%s", host, port)
+                endpoint["host"] = host
+                return True
+        except Exception:
+            pass
+        return False
     
-    # 既にサーバーが起動しているかチェック
-    if check_server_running():
-        logger.info("✅ セッション管理サーバーは既に起動しています")
-        return True
+    # 以前のセッションで接続できたホストがあれば、まずそこだけを確認する
+    if "host" in endpoint:
+        if check_server_running(endpoint["host"], timeout=0.1):
+            logger.info("✅ セッション管理サーバーは既に起動しています")
+            return True
+        endpoint.clear()
     
     try:
-        # バックグラウンドでサーバー起動
-        server_thread = threading.Thread(target=run_server, daemon=True)
-        server_thread.start()
+        # 確認を待たずにサーバースレッドを起動する（プロセス内で1つだけ。停止していれば起動し直す）
+        # 既に別プロセスが待ち受けている場合はスレッド側がエラー終了し、下の確認が成功する
+        if not _session_server_thread().is_alive():
+            _session_server_thread.clear()
+            _session_server_thread()
         
         # サーバー起動待機（最大15秒、Hugging Face Spacesでは時間がかかる場合がある）
+        # 50msから始めて最大500msまで間隔を伸ばしながらポーリングする
         max_wait = 15
-        for i in range(max_wait):
-            time.sleep(1)
+        started_at = time.monotonic()
+        deadline = started_at + max_wait
+        delay = 0.05
+        while True:
             if check_server_running():
-                logger.info(f"✅ セッション管理サーバー起動成功 ({i+1}秒)")
+                logger.info("✅ セッション管理サーバー起動成功 (%.2f秒)", time.monotonic() - started_at)
+                return True
+            if time.monotonic() >= deadline:
+                break
+            time.sleep(delay)
+            delay = min(delay * 1.5, 0.5)
+        
+        # 最後に別のホスト名でも一度だけ確認する
+        for host in fallback_hosts:
+            if check_server_running(host, timeout=2):
+                logger.info("✅ セッション管理サーバー起動成功 (%s)", host)
                 return True
-            if i < max_wait - 1:  # 最後の試行以外でログ出力
-                logger.info(f"サーバー起動待機中... ({i+1}/{max_wait})")
         
         logger.warning("⚠️ セッション管理サーバー起動タイムアウト - フォールバックモードで継続")
         return False
@@ -110,166 +167,541 @@ if 'server_started' not in st.session_state:
 
 # --- 必要なモジュールのインポート ---
 
+# 管理クラスの生成にのみ使うモジュールは initialize_all_managers 内で遅延インポートする
 # << 麻理チャット用モジュール >>
-from core_dialogue import DialogueGenerator
-from core_sentiment import SentimentAnalyzer
-from core_rate_limiter import RateLimiter
 from core_scene_manager import SceneManager  # 復元したモジュール
 from core_memory_manager import MemoryManager
-from components_chat_interface import ChatInterface
-from components_status_display import StatusDisplay
-from components_dog_assistant import DogAssistant
-from components_tutorial import TutorialManager
 from session_manager import SessionManager, get_session_manager, validate_session_state, perform_detailed_session_validation
-from session_api_client import SessionAPIClient
 # << 手紙生成用モジュール >>
 from letter_config import Config
-from letter_logger import setup_logger as setup_letter_logger
-from letter_generator import LetterGenerator
-from letter_request_manager import RequestManager
-from letter_user_manager import UserManager
-from async_storage_manager import AsyncStorageManager
-from async_rate_limiter import AsyncRateLimitManager
 
 # --- 定数 ---
 MAX_INPUT_LENGTH = 200
 MAX_HISTORY_TURNS = 50
+CONTEXT_HISTORY_TURNS = 5  # 対話生成に渡す直近の会話ターン数
+
+# 会話開始時（初期化・リセット時）の麻理の最初のメッセージ（使用時はコピーして使う）
+_INITIAL_MESSAGE = {"role": "assistant", "content": "何の用？遊びに来たの？", "is_initial": True}
+
+# 好感度のマイルストーン（閾値の昇順）
+_MILESTONES = (
+    (40, "🌸 麻理があなたに心を開き始めました！手紙をリクエストできるようになりました。"),
+    (60, "💖 麻理があなたを信頼するようになりました！より深い会話ができるようになります。"),
+    (80, "✨ 麻理があなたを大切な人だと思っています！特別な反応が増えるでしょう。"),
+    (100, "🌟 麻理があなたを心から愛しています！最高の関係に到達しました！"),
+)
+_MILESTONE_THRESHOLDS = [threshold for threshold, _ in _MILESTONES]
+
+# 好感度変化の通知メッセージのテンプレート
+_AFFECTION_MILESTONE_TMPL = "🎉 **マイルストーン達成！** {reason} (現在の好感度: {affection}/100)"
+_AFFECTION_UP_TMPL = "💕 **+{amount}** {reason} (現在の好感度: {affection}/100)"
+_AFFECTION_DOWN_TMPL = "💔 **{amount}** {reason} (現在の好感度: {affection}/100)"
+_LETTER_SUMMARY_TMPL = "手紙のテーマ「{theme}」について麻理が書いた内容: {preview}..."
+_LETTER_PREVIEW_CHARS = 200  # 記憶に残す手紙本文の先頭文字数
+
+# --- 静的なMarkdown/CSS（再実行毎に再生成しないようモジュールレベルで保持） ---
+_CHAT_TUTORIAL_MD = """
+### 🤖 麻理について
+麻理は感情を持つアンドロイドです。あなたとの会話を通じて関係性が変化していきます。
+
+### 💝 好感度システム
+- **会話の内容**によって好感度が上下します
+- **優しい言葉**をかけると好感度が上がります
+- **冷たい態度**だと好感度が下がることも...
+- サイドバーで現在の好感度を確認できます
+
+### 🐕 本音表示機能
+特定の場所について話すと、背景が自動的に変わります：
+- 🏖️ **ビーチ**や**海**の話 → 夕日のビーチ
+- ⛩️ **神社**や**お参り**の話 → 神社の境内
+- ☕ **カフェ**や**コーヒー**の話 → 午後のカフェ
+- 🐠 **水族館**や**魚**の話 → 夜の水族館
+- 🎆 **お祭り**や**花火**の話 → 夜祭り
+
+### 💬 会話のコツ
+1. **自然な会話**を心がけてください
+2. **質問**をすると麻理が詳しく答えてくれます
+3. **感情**を込めた言葉は特に反応が良いです
+4. **200文字以内**でメッセージを送ってください
+
+### ⚙️ 便利な機能
+- **サイドバー**：好感度やシーン情報を確認
+- **会話履歴**：過去の会話を振り返り
+- **リセット機能**：新しい関係から始めたい時に
+
+---
+**準備ができたら、下のチャット欄で麻理に話しかけてみてください！** 😊
+"""
+
+# 手紙の生成時間の選択肢と表示ラベル（設定値から起動時に1回だけ組み立てる）
+_HOUR_LABELS = {h: f"深夜 {h}時" for h in Config.BATCH_SCHEDULE_HOURS}
+
+_LETTER_TUTORIAL_MD = """
+### ✉️ 手紙機能について
+麻理があなたのために、心を込めて手紙を書いてくれる特別な機能です。
+
+### 📅 利用方法
+1. **好感度を上げる**：手紙をリクエストするには好感度40以上が必要です
+2. **テーマを入力**：手紙に書いてほしい内容やテーマを入力
+3. **時間を選択**：手紙を書いてほしい深夜の時間を選択
+4. **リクエスト送信**：「この内容でお願いする」ボタンを押す
+5. **手紙を受け取り**：指定した時間に手紙が生成されます
+6. **会話に反映**：手紙を読んだ後、「会話に反映」ボタンで麻理との会話で話題にできます
+
+### 💡 テーマの例
+- 「今日見た美しい夕日について」
+- 「最近読んだ本の感想」
+- 「季節の変わり目の気持ち」
+- 「大切な人への想い」
+- 「将来への希望や不安」
+
+### ⏰ 生成時間
+- **深夜2時〜4時**の間で選択可能
+- 静かな夜の時間に、ゆっくりと手紙を綴ります
+- **1日1通まで**リクエスト可能
+
+### 💝 利用条件
+- **好感度40以上**が必要です
+- 麻理との会話を重ねて関係を深めてください
+
+### 📖 手紙の確認
+- 生成された手紙は下の「あなたへの手紙」で確認できます
+- 過去の手紙も保存されているので、いつでも読み返せます
+
+---
+**心に残るテーマを入力して、麻理からの特別な手紙を受け取ってみてください** 💌
+"""
+
+_MEMORY_NOTIFICATION_CSS = """
+<style>
+.memory-notification {
+    background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
+    color: white;
+    padding: 15px 20px;
+    border-radius: 12px;
+    border: 2px solid #ffffff40;
+    box-shadow: 0 8px 32px rgba(0, 0, 0, 0.3);
+    backdrop-filter: blur(10px);
+    margin: 10px 0;
+    animation: slideIn 0.5s ease-out;
+    text-align: center;
+    font-weight: 500;
+}
+
+@keyframes slideIn {
+    from {
+        opacity: 0;
+        transform: translateY(-20px);
+    }
+    to {
+        opacity: 1;
+        transform: translateY(0);
+    }
+}
+
+.memory-notification .icon {
+    font-size: 1.2em;
+    margin-right: 8px;
+}
+</style>
+"""
+
+_MEMORY_NOTIFICATION_TMPL = '<div class="memory-notification"><span class="icon">🧠✨</span>{message}</div>'
+
+_FALLBACK_CSS = """
+<style>
+.stApp {
+    background: linear-gradient(135deg, #f8fafc 0%, #e2e8f0 100%);
+}
+.stApp > div:first-child {
+    background: rgba(255, 255, 255, 0.95);
+    backdrop-filter: blur(5px);
+    min-height: 100vh;
+}
+.stChatMessage {
+    background: rgba(255, 255, 255, 0.95) !important;
+    border-radius: 12px !important;
+    border: 1px solid rgba(0, 0, 0, 0.1) !important;
+    margin: 8px 0 !important;
+}
+</style>
+"""
+
+# 背景の静的なスタイル（画像はテーマごとに --mari-bg 変数で差し替える）
+_BACKGROUND_BASE_CSS = """
+<style>
+.stApp {
+    background-image: var(--mari-bg);
+    background-size: cover;
+    background-position: center;
+    background-attachment: fixed;
+    background-repeat: no-repeat;
+    transition: background-image 1.5s ease-in-out;
+}
+
+.stApp > div:first-child {
+    background: rgba(250, 243, 224, 0.95);
+    backdrop-filter: blur(5px);
+    min-height: 100vh;
+    transition: background 1.5s ease-in-out, backdrop-filter 1.5s ease-in-out;
+}
+</style>
+"""
+
+_BACKGROUND_FALLBACK_CSS = """
+<style>
+.stApp {
+    background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
+}
+.stApp > div:first-child {
+    background: rgba(0, 0, 0, 0.5);
+    backdrop-filter: blur(5px);
+}
+</style>
+"""
+
+# 考え中アニメーション（静的なため、インポート時に一度だけ結合しておく）
+_THINKING_CSS = """
+<style>
+.thinking-container {
+    display: flex;
+    flex-direction: column;
+    align-items: center;
+    justify-content: center;
+    padding: 20px;
+    background: rgba(255, 255, 255, 0.95);
+    border-radius: 20px;
+    border: 2px solid rgba(255, 182, 193, 0.6);
+    box-shadow: 0 8px 32px rgba(255, 182, 193, 0.3);
+    backdrop-filter: blur(10px);
+    margin: 20px 0;
+    animation: containerPulse 2s ease-in-out infinite;
+}
+
+.thinking-face {
+    font-size: 3em;
+    margin-bottom: 15px;
+    animation: faceRotate 3s ease-in-out infinite;
+    filter: drop-shadow(0 0 10px rgba(255, 105, 180, 0.5));
+}
+
+.thinking-text {
+    font-size: 1.2em;
+    color: #ff69b4;
+    font-weight: 600;
+    margin-bottom: 15px;
+    animation: textGlow 1.5s ease-in-out infinite alternate;
+}
+
+.thinking-dots {
+    display: flex;
+    gap: 8px;
+}
+
+.thinking-dot {
+    width: 12px;
+    height: 12px;
+    border-radius: 50%;
+    background: linear-gradient(45deg, #ff69b4, #ff1493);
+    animation: dotBounce 1.4s ease-in-out infinite;
+}
+
+.thinking-dot:nth-child(1) { animation-delay: 0s; }
+.thinking-dot:nth-child(2) { animation-delay: 0.2s; }
+.thinking-dot:nth-child(3) { animation-delay: 0.4s; }
+
+@keyframes containerPulse {
+    0%, 100% { transform: scale(1); box-shadow: 0 8px 32px rgba(255, 182, 193, 0.3); }
+    50% { transform: scale(1.02); box-shadow: 0 12px 40px rgba(255, 182, 193, 0.5); }
+}
+
+@keyframes faceRotate {
+    0%, 100% { transform: rotate(0deg); }
+    25% { transform: rotate(-5deg); }
+    75% { transform: rotate(5deg); }
+}
+
+@keyframes textGlow {
+    0% { text-shadow: 0 0 5px rgba(255, 105, 180, 0.5); }
+    100% { text-shadow: 0 0 20px rgba(255, 105, 180, 0.8), 0 0 30px rgba(255, 105, 180, 0.6); }
+}
+
+@keyframes dotBounce {
+    0%, 80%, 100% { transform: translateY(0); opacity: 0.7; }
+    40% { transform: translateY(-15px); opacity: 1; }
+}
+
+.sound-wave {
+    display: flex;
+    gap: 3px;
+    margin-top: 10px;
+}
+
+.sound-bar {
+    width: 4px;
+    height: 20px;
+    background: linear-gradient(to top, #ff69b4, #ff1493);
+    border-radius: 2px;
+    transform-origin: bottom;
+    animation: soundWave 1s ease-in-out infinite;
+}
+
+/* 周期と遅延を棒ごとにずらし、JavaScriptなしで不規則な音波に見せる */
+.sound-bar:nth-child(1) { animation-delay: 0s; animation-duration: 0.9s; }
+.sound-bar:nth-child(2) { animation-delay: 0.1s; animation-duration: 1.15s; }
+.sound-bar:nth-child(3) { animation-delay: 0.2s; animation-duration: 0.8s; }
+.sound-bar:nth-child(4) { animation-delay: 0.3s; animation-duration: 1.05s; }
+.sound-bar:nth-child(5) { animation-delay: 0.4s; animation-duration: 0.95s; }
+
+@keyframes soundWave {
+    0%, 100% { transform: scaleY(0.75); }
+    50% { transform: scaleY(1.4); }
+}
+</style>
+"""
+
+_THINKING_HTML = """
+<div class="thinking-container">
+    <div class="thinking-face">🤔</div>
+    <div class="thinking-text">麻理が考え中...</div>
+    <div class="thinking-dots">
+        <div class="thinking-dot"></div>
+        <div class="thinking-dot"></div>
+        <div class="thinking-dot"></div>
+    </div>
+    <div class="sound-wave">
+        <div class="sound-bar"></div>
+        <div class="sound-bar"></div>
+        <div class="sound-bar"></div>
+        <div class="sound-bar"></div>
+        <div class="sound-bar"></div>
+    </div>
+    <div style="margin-top: 10px; font-size: 0.9em; color: #ff69b4; opacity: 0.8;">
+        💭 あんたのために一生懸命考えてるんだから...
+    </div>
+</div>
+"""
+
+_THINKING_BLOB = _THINKING_CSS + _THINKING_HTML
+
+# サイドバー用CSS（セーフティボタン・好感度ラベル・設定メニュー）
+_SIDEBAR_CSS = """
+<style>
+.safety-button {
+    color: white;
+    border: none;
+    border-radius: 8px;
+    padding: 10px 15px;
+    font-size: 16px;
+    font-weight: bold;
+    cursor: pointer;
+    width: 100%;
+    margin-bottom: 15px;
+    transition: all 0.3s ease;
+    box-shadow: 0 2px 4px rgba(0,0,0,0.2);
+}
+.safety-button:hover {
+    transform: translateY(-2px);
+    box-shadow: 0 4px 8px rgba(0,0,0,0.3);
+}
+/* 好感度の文字を白くする */
+.affection-label {
+    color: white !important;
+    font-weight: bold;
+    font-size: 16px;
+    margin-bottom: 10px;
+}
+/* 設定ボタン内の表示を大きくする */
+.settings-content {
+    font-size: 18px !important;
+}
+.settings-content .stButton > button {
+    font-size: 18px !important;
+    padding: 12px 20px !important;
+    height: auto !important;
+}
+.settings-content .stButton > button div {
+    font-size: 18px !important;
+}
+</style>
+"""
+
+# セーフティボタンの色（モードにより変化する部分のみ）
+_SAFETY_COLOR_CSS_TMPL = "<style>.safety-button{{background-color:{color};}}</style>"
 
-def get_event_loop():
+# デバッグパネルのテキスト表示用テンプレート
+_SESSION_ID_DETAIL_TMPL = """セッション整合性: {status}
+オリジナルID: {original_session_id}
+現在のID: {current_session_id}
+保存されたID: {stored_session_id}
+ユーザーID: {user_id}
+セッション継続時間: {session_age_minutes} 分
+最終検証時刻: {last_validated:.19}"""
+
+_TECH_DETAIL_TMPL = """Python オブジェクトID:
+- st.session_state: {session_state_id}
+- SessionManager: {session_manager_id}
+- MemoryManager: {memory_manager_id}
+
+環境変数:
+- DEBUG_MODE: {debug_mode}
+- FORCE_SESSION_RESET: {force_session_reset}
+
+Streamlit情報:
+- セッション状態キー数: {session_keys_count}
+- 内部セッションID: {internal_session_id}"""
+
+def trim_chat_messages(messages: list) -> None:
     """
-    セッションごとに単一のイベントループを取得または作成する
+    チャット履歴をMAX_HISTORY_TURNSターン分に制限する（その場で古いメッセージを削除）
+    初期メッセージ（is_initial=True）は常に保持する
     """
-    try:
-        # 既に実行中のループがあればそれを返す
-        return asyncio.get_running_loop()
-    except RuntimeError:
-        # 実行中のループがなければ、新しく作成
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        return loop
+    excess = len(messages) - (2 * MAX_HISTORY_TURNS + 1)
+    if excess > 0:
+        start = 1 if messages[0].get('is_initial', False) else 0
+        del messages[start:start + excess]
+
+@st.cache_resource
+def get_background_loop():
+    """
+    プロセス全体で共有する永続イベントループを取得する
+    ループは専用のバックグラウンドスレッドで常時実行され、各セッションから並行して利用できる
+    Streamlitはスクリプトを再実行するため、st.cache_resourceで単一インスタンスを保持する
+    """
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True, name="mari:async_loop").start()
+    atexit.register(loop.call_soon_threadsafe, loop.stop)
+    logger.info("バックグラウンドイベントループを起動しました")
+    return loop
 
 def run_async(coro):
     """
-    Streamlitのセッションで共有されたイベントループを使って非同期関数を実行する
+    共有の永続イベントループ上で非同期関数を実行し、結果を待つ
+    （呼び出し毎のスレッド生成・ループ生成を避ける）
     """
-    try:
-        # 既存のループがあるかチェック
-        loop = asyncio.get_running_loop()
-        # 既存のループがある場合は、新しいタスクとして実行
-        import concurrent.futures
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            future = executor.submit(asyncio.run, coro)
-            return future.result()
-    except RuntimeError:
-        # 実行中のループがない場合は、新しいループで実行
-        return asyncio.run(coro)
+    return asyncio.run_coroutine_threadsafe(coro, get_background_loop()).result()
+
+@st.cache_data(show_spinner=False)
+def _build_background_css(image_url: str) -> str:
+    """背景画像URLごとの背景CSSを生成する（URL単位でメモ化、テーマで変わるのはCSS変数のみ）"""
+    return f"<style>:root {{ --mari-bg: url('{image_url}'); }}</style>\n{_BACKGROUND_BASE_CSS}"
 
 def update_background(scene_manager: SceneManager, theme: str):
-    """現在のテーマに基づいて背景画像を動的に設定するCSSを注入する（重複実行防止）"""
-    # 現在のテーマと前回のテーマを比較
-    last_theme = st.session_state.get('last_background_theme', '')
-    if last_theme == theme:
-        return  # 同じテーマの場合は更新しない
-    
+    """現在のテーマに基づいて背景画像を動的に設定するCSSを注入する"""
     try:
         # SceneManagerから画像のURLを取得
         image_url = scene_manager.get_theme_url(theme)
         if not image_url:
-            logger.warning(f"Theme '{theme}' has no valid image URL.")
+            logger.warning("Theme '%s' has no valid image URL.", theme)
             return
 
-        # 改善されたCSSを生成
-        background_css = f"""
-        <style>
-        .stApp {{
-            background-image: url('{image_url}');
-            background-size: cover;
-            background-position: center;
-            background-attachment: fixed;
-            background-repeat: no-repeat;
-            transition: background-image 1.5s ease-in-out;
-        }}
-        
-        .stApp > div:first-child {{
-            background: rgba(250, 243, 224, 0.95);
-            backdrop-filter: blur(5px);
-            min-height: 100vh;
-            transition: background 1.5s ease-in-out, backdrop-filter 1.5s ease-in-out;
-        }}
-        </style>
-        """
-        st.markdown(background_css, unsafe_allow_html=True)
-        logger.info(f"背景を'{theme}'に変更しました")
-        
-        # 現在のテーマを記録
-        st.session_state.last_background_theme = theme
+        # メモ化済みのCSSを毎回出力する（再実行で出力しない要素は画面から消えるため）
+        st.markdown(_build_background_css(image_url), unsafe_allow_html=True)
+
+        # テーマが変わった時だけ記録・ログ出力する
+        if st.session_state.get('last_background_theme', '') != theme:
+            logger.info("背景を'%s'に変更しました", theme)
+            st.session_state.last_background_theme = theme
         
     except Exception as e:
-        logger.error(f"背景更新エラー: {e}")
+        logger.error("背景更新エラー: %s", e)
         # フォールバック背景を適用
-        fallback_css = """
-        <style>
-        .stApp {
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-        }
-        .stApp > div:first-child {
-            background: rgba(0, 0, 0, 0.5);
-            backdrop-filter: blur(5px);
-        }
-        </style>
-        """
-        st.markdown(fallback_css, unsafe_allow_html=True)
+        st.markdown(_BACKGROUND_FALLBACK_CSS, unsafe_allow_html=True)
         st.session_state.last_background_theme = theme
 
 # --- ▼▼▼ 1. 初期化処理の一元管理 ▼▼▼ ---
 
 @st.cache_resource
-def initialize_all_managers():
-    """
-    アプリケーション全体で共有する全ての管理クラスを初期化する
-    Streamlitのキャッシュ機能により、シングルトンとして振る舞う
-    """
-    logger.info("Initializing all managers...")
-    # --- 手紙機能の依存モジュール ---
+def _init_letter_managers():
+    """手紙機能の管理クラスを初期化する（手紙タブで初めて必要になった時に一度だけ）"""
+    from letter_generator import LetterGenerator
+    from letter_request_manager import RequestManager
+    from letter_user_manager import UserManager
+    from async_storage_manager import AsyncStorageManager
+    from async_rate_limiter import AsyncRateLimitManager
+
+    logger.info("Initializing letter managers...")
     letter_storage = AsyncStorageManager(Config.STORAGE_PATH)
     letter_rate_limiter = AsyncRateLimitManager(letter_storage, max_requests=Config.MAX_DAILY_REQUESTS)
-    user_manager = UserManager(letter_storage)
-    letter_request_manager = RequestManager(letter_storage, letter_rate_limiter)
-    letter_generator = LetterGenerator()
-
-    request_manager = RequestManager(letter_storage, letter_rate_limiter)
+    managers = {
+        "user_manager": UserManager(letter_storage),
+        "request_manager": RequestManager(letter_storage, letter_rate_limiter),
+        "letter_generator": LetterGenerator(),
+    }
+    logger.info("Letter managers initialized.")
+    return managers
 
-    # --- チャット機能の依存モジュール ---
+@st.cache_resource
+def _init_chat_managers():
+    """チャット機能と画面共通の管理クラスを初期化する"""
+    # 生成時にのみ必要なモジュール（キャッシュにより初回の一度だけ読み込まれる）
+    from core_dialogue import DialogueGenerator
+    from core_sentiment import SentimentAnalyzer
+    from core_rate_limiter import RateLimiter
+    from components_chat_interface import ChatInterface
+    from components_status_display import StatusDisplay
+    from components_dog_assistant import DogAssistant
+    from components_tutorial import TutorialManager
+    from session_api_client import SessionAPIClient
+
+    logger.info("Initializing chat managers...")
     dialogue_generator = DialogueGenerator()
     sentiment_analyzer = SentimentAnalyzer()
-    rate_limiter = RateLimiter()
     scene_manager = SceneManager()
     # memory_manager は セッション単位で作成するため、ここでは作成しない
-    chat_interface = ChatInterface(max_input_length=MAX_INPUT_LENGTH)
-    status_display = StatusDisplay()
-    dog_assistant = DogAssistant()
-    tutorial_manager = TutorialManager()
-    session_api_client = SessionAPIClient()
-
-    logger.info("All managers initialized.")
-    return {
-        # 手紙用
-        "user_manager": user_manager,
-        "request_manager": request_manager,
-        "letter_generator": letter_generator,
-        # チャット用
+    # 以下の共有コンポーネントは設定値のみを保持し、ユーザー固有の状態は
+    # st.session_state 側に置くため、全セッションで共有しても安全
+    managers = {
         "dialogue_generator": dialogue_generator,
         "sentiment_analyzer": sentiment_analyzer,
-        "rate_limiter": rate_limiter,
+        "rate_limiter": RateLimiter(),
         "scene_manager": scene_manager,
-        # memory_manager は セッション単位で作成
-        "chat_interface": chat_interface,
-        "status_display": status_display,
-        "dog_assistant": dog_assistant,
-        "tutorial_manager": tutorial_manager,
-        "session_api_client": session_api_client,
+        "chat_interface": ChatInterface(max_input_length=MAX_INPUT_LENGTH),
+        "status_display": StatusDisplay(),
+        "dog_assistant": DogAssistant(),
+        "tutorial_manager": TutorialManager(),
+        "session_api_client": SessionAPIClient(),
     }
 
+    # 初回のチャットで遅延ロードのコストを払わないよう、起動時にウォームアップする
+    scene_manager.get_theme_url("default")
+    sentiment_analyzer.get_relationship_stage(30)
+    sentiment_analyzer.analyze_sentiment("こんにちは")  # 感情分析モデルの初回推論
+    dialogue_generator.get_system_prompt_mari()
+
+    logger.info("Chat managers initialized.")
+    return managers
+
+_LETTER_MANAGER_KEYS = ("user_manager", "request_manager", "letter_generator")
+_CHAT_MANAGER_KEYS = (
+    "dialogue_generator", "sentiment_analyzer", "rate_limiter", "scene_manager",
+    "chat_interface", "status_display", "dog_assistant", "tutorial_manager", "session_api_client",
+)
+
+class _Managers(Mapping):
+    """管理クラスの辞書。キーが属する機能の管理クラス群を初回アクセス時に初期化する"""
+
+    def __getitem__(self, key):
+        if key in _LETTER_MANAGER_KEYS:
+            return _init_letter_managers()[key]
+        return _init_chat_managers()[key]
+
+    def __iter__(self):
+        return itertools.chain(_CHAT_MANAGER_KEYS, _LETTER_MANAGER_KEYS)
+
+    def __len__(self):
+        return len(_CHAT_MANAGER_KEYS) + len(_LETTER_MANAGER_KEYS)
+
+_MANAGERS = _Managers()
+
+def initialize_all_managers():
+    """
+    アプリケーション全体で共有する全ての管理クラスを返す
+    実体は機能ごとの st.cache_resource で生成され、シングルトンとして振る舞う
+    （手紙機能の管理クラスは手紙タブで初めて使われるまで生成しない）
+    """
+    return _MANAGERS
+
 def initialize_session_state(managers, force_reset_override=False):
     """
     アプリケーション全体のセッションステートを初期化する
@@ -280,7 +712,7 @@ def initialize_session_state(managers, force_reset_override=False):
         force_reset_override: 強制リセットフラグ（フルリセット時に使用）
     """
     # 強制リセットフラグ（開発時用または明示的な指定）
-    force_reset = force_reset_override or os.getenv("FORCE_SESSION_RESET", "false").lower() == "true"
+    force_reset = force_reset_override or Config.FORCE_SESSION_RESET
     
     # 初回起動時はセッション検証をスキップ
     is_first_run = 'user_id' not in st.session_state
@@ -302,7 +734,7 @@ def initialize_session_state(managers, force_reset_override=False):
         session_id = session_api_client.get_or_create_session_id()
     else:
         session_id = st.session_state.user_id
-        logger.debug(f"既存ユーザーID使用: {session_id[:8]}...")
+        logger.debug("既存ユーザーID使用: %s...", session_id[:8])
     
     # ユーザーIDとしてセッションIDを使用
     session_changed = ('user_id' not in st.session_state or 
@@ -315,15 +747,16 @@ def initialize_session_state(managers, force_reset_override=False):
         # SessionManagerにユーザーIDを設定
         session_manager.set_user_id(st.session_state.user_id)
         
-        # セッション情報をログ出力
-        session_info = {
-            "user_id": st.session_state.user_id[:8] + "...",  # プライバシー保護のため一部のみ
-            "session_id": id(st.session_state),
-            "force_reset": force_reset,
-            "session_changed": session_changed,
-            "timestamp": datetime.now().isoformat()
-        }
-        logger.info(f"FastAPIセッション管理でユーザーセッション設定: {session_info}")
+        # セッション情報をログ出力（INFOが無効な場合は情報の組み立て自体を省略）
+        if logger.isEnabledFor(logging.INFO):
+            session_info = {
+                "user_id": st.session_state.user_id[:8] + "...",  # プライバシー保護のため一部のみ
+                "session_id": id(st.session_state),
+                "force_reset": force_reset,
+                "session_changed": session_changed,
+                "timestamp": time.time()
+            }
+            logger.info("FastAPIセッション管理でユーザーセッション設定: %s", session_info)
         
         # セッション固有の識別子を保存
         st.session_state._session_id = id(st.session_state)
@@ -332,26 +765,26 @@ def initialize_session_state(managers, force_reset_override=False):
         if session_manager.user_id != st.session_state.user_id:
             session_manager.set_user_id(st.session_state.user_id)
         
-        logger.debug(f"既存セッション継続使用: {st.session_state.user_id[:8]}...")
+        logger.debug("既存セッション継続使用: %s...", st.session_state.user_id[:8])
 
     # チャット機能用のセッション初期化
     if 'chat_initialized' not in st.session_state or force_reset:
-        initial_message = "何の用？遊びに来たの？"
         st.session_state.chat = {
-            "messages": [{"role": "assistant", "content": initial_message, "is_initial": True}],
+            "messages": [dict(_INITIAL_MESSAGE)],
             "affection": 30,
             "scene_params": {"theme": "default"},
             "limiter_state": managers["rate_limiter"].create_limiter_state(),
             "scene_change_pending": None,
-            "ura_mode": False  # 裏モードフラグ
+            "ura_mode": False,  # 裏モードフラグ
+            "recent_turns": deque(maxlen=CONTEXT_HISTORY_TURNS)  # 直近の会話ペア（履歴構築用）
         }
         
-        logger.info(f"チャット初期化完了 - 初期メッセージ: '{initial_message}'")
+        logger.info("チャット初期化完了 - 初期メッセージ: '%s'", _INITIAL_MESSAGE['content'])
         # 特別な記憶の通知用
         st.session_state.memory_notifications = []
         # 好感度変化の通知用
         st.session_state.affection_notifications = []
-        st.session_state.debug_mode = os.getenv("DEBUG_MODE", "false").lower() == "true"
+        st.session_state.debug_mode = Config.DEBUG_MODE
         st.session_state.chat_initialized = True
         
         # セッション単位でMemoryManagerを作成
@@ -360,34 +793,14 @@ def initialize_session_state(managers, force_reset_override=False):
         # Streamlitの内部チャット状態をクリア
         if 'messages' in st.session_state:
             del st.session_state.messages
-        if 'last_sent_message' in st.session_state:
-            del st.session_state.last_sent_message
-        if 'user_message_input' in st.session_state:
-            del st.session_state.user_message_input
         
         if force_reset:
             logger.info("Session force reset - all data cleared")
         else:
             logger.info("Chat session state initialized with SessionManager.")
     
-    # MemoryManagerがセッション状態にない場合は作成
-    if 'memory_manager' not in st.session_state:
-        st.session_state.memory_manager = MemoryManager(history_threshold=10)
-    
-    # 特別な記憶の通知用リストが存在しない場合は作成
-    if 'memory_notifications' not in st.session_state:
-        st.session_state.memory_notifications = []
-    
-    # 好感度変化の通知用リストが存在しない場合は作成
-    if 'affection_notifications' not in st.session_state:
-        st.session_state.affection_notifications = []
-    
-    # 裏モードフラグが存在しない場合は作成
-    if 'ura_mode' not in st.session_state.chat:
-        st.session_state.chat['ura_mode'] = False
-    
-    # 最終的なセッション整合性チェック
-    if not session_manager.validate_session_integrity():
+    # 最終的なセッション整合性チェック（作成直後のセッションは不整合になり得ないためスキップ）
+    if not (is_first_run or force_reset) and not session_manager.validate_session_integrity():
         logger.warning("Session integrity check failed after initialization")
         session_manager.recover_session()
 
@@ -400,321 +813,105 @@ def initialize_session_state(managers, force_reset_override=False):
 
 # --- ▼▼▼ 2. UIコンポーネントの関数化 ▼▼▼ ---
 
+@st.cache_data(show_spinner=False)
+def _read_css(file_path: str, mtime: float) -> str:
+    """CSSファイルを読み込み、<style>タグで包んだ文字列を返す（パスと更新時刻をキーにキャッシュ）"""
+    with open(file_path, "r", encoding="utf-8") as f:
+        return f"<style>{f.read()}</style>"
+
 def inject_custom_css(file_path="streamlit_styles.css"):
-    """外部CSSファイルを読み込んで注入する（一度だけ実行）"""
-    # CSS読み込み済みフラグをチェック
-    if st.session_state.get('css_loaded', False):
-        return
-    
+    """外部CSSファイルを読み込んで注入する（ファイル読み込みはキャッシュ済みの内容を再利用）"""
+    # 再実行で出力しない要素は画面から消えるため、CSSは毎回出力する
     try:
-        with open(file_path, "r", encoding="utf-8") as f:
-            css_content = f.read()
-            st.markdown(f"<style>{css_content}</style>", unsafe_allow_html=True)
-            logger.info(f"CSSファイルを読み込みました: {file_path}")
-            st.session_state.css_loaded = True
+        st.markdown(_read_css(file_path, os.path.getmtime(file_path)), unsafe_allow_html=True)
     except FileNotFoundError:
         logger.warning(f"CSSファイルが見つかりません: {file_path}")
         # フォールバック用の基本スタイルを適用
         apply_fallback_css()
-        st.session_state.css_loaded = True
     except Exception as e:
         logger.error(f"CSS読み込みエラー: {e}")
         apply_fallback_css()
-        st.session_state.css_loaded = True
 
 def apply_fallback_css():
     """フォールバック用の基本CSSを適用"""
-    fallback_css = """
-    <style>
-    .stApp {
-        background: linear-gradient(135deg, #f8fafc 0%, #e2e8f0 100%);
-    }
-    .stApp > div:first-child {
-        background: rgba(255, 255, 255, 0.95);
-        backdrop-filter: blur(5px);
-        min-height: 100vh;
-    }
-    .stChatMessage {
-        background: rgba(255, 255, 255, 0.95) !important;
-        border-radius: 12px !important;
-        border: 1px solid rgba(0, 0, 0, 0.1) !important;
-        margin: 8px 0 !important;
-    }
-    </style>
-    """
-    st.markdown(fallback_css, unsafe_allow_html=True)
+    st.markdown(_FALLBACK_CSS, unsafe_allow_html=True)
     logger.info("フォールバック用CSSを適用しました")
 
 
 
-def show_memory_notification(message: str):
-    """特別な記憶の通知をポップアップ風に表示する"""
-    notification_css = """
-    <style>
-    .memory-notification {
-        background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-        color: white;
-        padding: 15px 20px;
-        border-radius: 12px;
-        border: 2px solid #ffffff40;
-        box-shadow: 0 8px 32px rgba(0, 0, 0, 0.3);
-        backdrop-filter: blur(10px);
-        margin: 10px 0;
-        animation: slideIn 0.5s ease-out;
-        text-align: center;
-        font-weight: 500;
-    }
-    
-    @keyframes slideIn {
-        from {
-            opacity: 0;
-            transform: translateY(-20px);
-        }
-        to {
-            opacity: 1;
-            transform: translateY(0);
-        }
-    }
-    
-    .memory-notification .icon {
-        font-size: 1.2em;
-        margin-right: 8px;
-    }
-    </style>
+def show_memory_notifications(messages: list):
     """
-    
-    notification_html = f"""
-    <div class="memory-notification">
-        <span class="icon">🧠✨</span>
-        {message}
-    </div>
+    特別な記憶の通知をポップアップ風に表示する
+    スタイルと全通知を1つの要素にまとめて描画する
     """
+    notifications_html = "".join(_MEMORY_NOTIFICATION_TMPL.format(message=message) for message in messages)
+    st.markdown(_MEMORY_NOTIFICATION_CSS + notifications_html, unsafe_allow_html=True)
+
+def check_affection_milestone(old_affection: int, new_affection: int):
+    """
+    好感度の変化で越えたマイルストーンのうち最初のものを返す
     
-    st.markdown(notification_css + notification_html, unsafe_allow_html=True)
-
-def check_affection_milestone(old_affection: int, new_affection: int) -> str:
-    """好感度のマイルストーンに到達したかチェックする"""
-    milestones = {
-        40: "🌸 麻理があなたに心を開き始めました！手紙をリクエストできるようになりました。",
-        60: "💖 麻理があなたを信頼するようになりました！より深い会話ができるようになります。",
-        80: "✨ 麻理があなたを大切な人だと思っています！特別な反応が増えるでしょう。",
-        100: "🌟 麻理があなたを心から愛しています！最高の関係に到達しました！"
-    }
-    
-    for milestone, message in milestones.items():
-        if old_affection < milestone <= new_affection:
-            return message
-    
-    return ""
+    Returns:
+        (閾値, メッセージ) のタプル。到達していない場合はNone
+    """
+    # old_affection を超える最初の閾値を二分探索で求める
+    i = bisect.bisect_right(_MILESTONE_THRESHOLDS, old_affection)
+    if i < len(_MILESTONES) and _MILESTONES[i][0] <= new_affection:
+        return _MILESTONES[i]
+    return None
 
-def show_affection_notification(change_amount: int, change_reason: str, new_affection: int, is_milestone: bool = False):
-    """好感度変化の通知を表示する（Streamlit標準コンポーネント使用）"""
+def format_affection_notification(change_amount: int, change_reason: str, new_affection: int, is_milestone: bool = False):
+    """
+    好感度変化の通知内容を組み立てる
+    
+    Returns:
+        (表示種別 "success"/"info", メッセージ) のタプル。通知不要の場合はNone
+    """
     # 好感度変化がない場合は通知しない（マイルストーン以外）
     if change_amount == 0 and not is_milestone:
-        return
+        return None
     
-    # マイルストーン通知の場合
     if is_milestone:
-        st.balloons()  # 特別な演出
-        st.success(f"🎉 **マイルストーン達成！** {change_reason} (現在の好感度: {new_affection}/100)")
+        return "success", _AFFECTION_MILESTONE_TMPL.format(reason=change_reason, affection=new_affection)
     elif change_amount > 0:
         # 好感度上昇
-        st.success(f"💕 **+{change_amount}** {change_reason} (現在の好感度: {new_affection}/100)")
+        return "success", _AFFECTION_UP_TMPL.format(amount=change_amount, reason=change_reason, affection=new_affection)
     else:
         # 好感度下降
-        st.info(f"💔 **{change_amount}** {change_reason} (現在の好感度: {new_affection}/100)")
+        return "info", _AFFECTION_DOWN_TMPL.format(amount=change_amount, reason=change_reason, affection=new_affection)
+
+def celebrate_milestone(milestone: int):
+    """マイルストーン到達の特別な演出（同じマイルストーンの閾値ではセッション中1回だけ）"""
+    shown = st.session_state.setdefault('_balloons_shown', set())
+    if milestone not in shown:
+        st.balloons()
+        shown.add(milestone)
+
+def show_affection_notifications(notifications: list):
+    """好感度変化の通知を表示する（同じ種別が続く通知は1つの要素にまとめる）"""
+    formatted = []
+    for notification in notifications:
+        if notification.get("is_milestone", False):
+            celebrate_milestone(notification["milestone_threshold"])
+        item = format_affection_notification(
+            notification["change_amount"],
+            notification["change_reason"],
+            notification["new_affection"],
+            notification.get("is_milestone", False)
+        )
+        if item:
+            formatted.append(item)
+    
+    for kind, group in itertools.groupby(formatted, key=lambda item: item[0]):
+        text = "\n\n".join(message for _, message in group)
+        if kind == "success":
+            st.success(text)
+        else:
+            st.info(text)
 
 def show_cute_thinking_animation():
     """かわいらしい考え中アニメーションを表示する"""
-    thinking_css = """
-    <style>
-    .thinking-container {
-        display: flex;
-        flex-direction: column;
-        align-items: center;
-        justify-content: center;
-        padding: 20px;
-        background: rgba(255, 255, 255, 0.95);
-        border-radius: 20px;
-        border: 2px solid rgba(255, 182, 193, 0.6);
-        box-shadow: 0 8px 32px rgba(255, 182, 193, 0.3);
-        backdrop-filter: blur(10px);
-        margin: 20px 0;
-        animation: containerPulse 2s ease-in-out infinite;
-    }
-    
-    .thinking-face {
-        font-size: 3em;
-        margin-bottom: 15px;
-        animation: faceRotate 3s ease-in-out infinite;
-        filter: drop-shadow(0 0 10px rgba(255, 105, 180, 0.5));
-    }
-    
-    .thinking-text {
-        font-size: 1.2em;
-        color: #ff69b4;
-        font-weight: 600;
-        margin-bottom: 15px;
-        animation: textGlow 1.5s ease-in-out infinite alternate;
-    }
-    
-    .thinking-dots {
-        display: flex;
-        gap: 8px;
-    }
-    
-    .thinking-dot {
-        width: 12px;
-        height: 12px;
-        border-radius: 50%;
-        background: linear-gradient(45deg, #ff69b4, #ff1493);
-        animation: dotBounce 1.4s ease-in-out infinite;
-    }
-    
-    .thinking-dot:nth-child(1) { animation-delay: 0s; }
-    .thinking-dot:nth-child(2) { animation-delay: 0.2s; }
-    .thinking-dot:nth-child(3) { animation-delay: 0.4s; }
-    
-    @keyframes containerPulse {
-        0%, 100% { transform: scale(1); box-shadow: 0 8px 32px rgba(255, 182, 193, 0.3); }
-        50% { transform: scale(1.02); box-shadow: 0 12px 40px rgba(255, 182, 193, 0.5); }
-    }
-    
-    @keyframes faceRotate {
-        0%, 100% { transform: rotate(0deg); }
-        25% { transform: rotate(-5deg); }
-        75% { transform: rotate(5deg); }
-    }
-    
-    @keyframes textGlow {
-        0% { text-shadow: 0 0 5px rgba(255, 105, 180, 0.5); }
-        100% { text-shadow: 0 0 20px rgba(255, 105, 180, 0.8), 0 0 30px rgba(255, 105, 180, 0.6); }
-    }
-    
-    @keyframes dotBounce {
-        0%, 80%, 100% { transform: translateY(0); opacity: 0.7; }
-        40% { transform: translateY(-15px); opacity: 1; }
-    }
-    
-    .sound-wave {
-        display: flex;
-        gap: 3px;
-        margin-top: 10px;
-    }
-    
-    .sound-bar {
-        width: 4px;
-        height: 20px;
-        background: linear-gradient(to top, #ff69b4, #ff1493);
-        border-radius: 2px;
-        animation: soundWave 1s ease-in-out infinite;
-    }
-    
-    .sound-bar:nth-child(1) { animation-delay: 0s; }
-    .sound-bar:nth-child(2) { animation-delay: 0.1s; }
-    .sound-bar:nth-child(3) { animation-delay: 0.2s; }
-    .sound-bar:nth-child(4) { animation-delay: 0.3s; }
-    .sound-bar:nth-child(5) { animation-delay: 0.4s; }
-    
-    @keyframes soundWave {
-        0%, 100% { height: 20px; }
-        50% { height: 35px; }
-    }
-    </style>
-    """
-    
-    thinking_html = """
-    <div class="thinking-container">
-        <div class="thinking-face">🤔</div>
-        <div class="thinking-text">麻理が考え中...</div>
-        <div class="thinking-dots">
-            <div class="thinking-dot"></div>
-            <div class="thinking-dot"></div>
-            <div class="thinking-dot"></div>
-        </div>
-        <div class="sound-wave">
-            <div class="sound-bar"></div>
-            <div class="sound-bar"></div>
-            <div class="sound-bar"></div>
-            <div class="sound-bar"></div>
-            <div class="sound-bar"></div>
-        </div>
-        <div style="margin-top: 10px; font-size: 0.9em; color: #ff69b4; opacity: 0.8;">
-            💭 あんたのために一生懸命考えてるんだから...
-        </div>
-    </div>
-    """
-    
-    # 音効果のJavaScript（Web Audio APIを使用した実際の音生成）
-    sound_js = """
-    <script>
-    // Web Audio APIを使用した音効果生成
-    function playThinkingSound() {
-        try {
-            const audioContext = new (window.AudioContext || window.webkitAudioContext)();
-            
-            // 柔らかい思考音を生成
-            const oscillator1 = audioContext.createOscillator();
-            const oscillator2 = audioContext.createOscillator();
-            const gainNode = audioContext.createGain();
-            
-            // 周波数設定（優しい音色）
-            oscillator1.frequency.setValueAtTime(220, audioContext.currentTime); // A3
-            oscillator2.frequency.setValueAtTime(330, audioContext.currentTime); // E4
-            
-            // 波形設定（柔らかいサイン波）
-            oscillator1.type = 'sine';
-            oscillator2.type = 'sine';
-            
-            // 音量設定（控えめに）
-            gainNode.gain.setValueAtTime(0, audioContext.currentTime);
-            gainNode.gain.linearRampToValueAtTime(0.1, audioContext.currentTime + 0.1);
-            gainNode.gain.linearRampToValueAtTime(0.05, audioContext.currentTime + 0.5);
-            gainNode.gain.linearRampToValueAtTime(0, audioContext.currentTime + 1.0);
-            
-            // 接続
-            oscillator1.connect(gainNode);
-            oscillator2.connect(gainNode);
-            gainNode.connect(audioContext.destination);
-            
-            // 再生
-            oscillator1.start(audioContext.currentTime);
-            oscillator2.start(audioContext.currentTime);
-            oscillator1.stop(audioContext.currentTime + 1.0);
-            oscillator2.stop(audioContext.currentTime + 1.0);
-            
-            console.log("🎵 麻理の思考音を再生中...");
-            
-        } catch (error) {
-            console.log("音声再生はサポートされていません:", error);
-        }
-    }
-    
-    // 視覚的な音波エフェクトの強化
-    setTimeout(() => {
-        const soundBars = document.querySelectorAll('.sound-bar');
-        soundBars.forEach((bar, index) => {
-            bar.style.animationDuration = (0.8 + Math.random() * 0.4) + 's';
-        });
-        
-        // 音効果を再生（ユーザーインタラクション後のみ）
-        playThinkingSound();
-    }, 100);
-    
-    // 定期的な音波効果
-    setInterval(() => {
-        const soundBars = document.querySelectorAll('.sound-bar');
-        if (soundBars.length > 0) {
-            soundBars.forEach((bar, index) => {
-                const randomHeight = 15 + Math.random() * 25;
-                bar.style.height = randomHeight + 'px';
-            });
-        }
-    }, 200);
-    </script>
-    """
-    
-    return st.markdown(thinking_css + thinking_html + sound_js, unsafe_allow_html=True)
+    return st.markdown(_THINKING_BLOB, unsafe_allow_html=True)
 
 @contextmanager
 def cute_thinking_spinner():
@@ -727,29 +924,434 @@ def cute_thinking_spinner():
         with placeholder.container():
             show_cute_thinking_animation()
         
-        yield
+        # 呼び出し側で途中終了できるようにプレースホルダーを渡す
+        yield placeholder
         
     finally:
         # アニメーション終了
         placeholder.empty()
 
+def _visible_part(text: str):
+    """
+    受信途中の応答から表示してよい部分（表面的な発言）を取り出す
+    [HIDDEN:...] の本音部分を受信中の場合はNoneを返す
+    """
+    stripped = text.lstrip()
+    if stripped.startswith("[HIDDEN:"):
+        end = stripped.find("]")
+        return stripped[end + 1:] if end != -1 else None
+    # マーカーの途中まで受信している可能性がある場合は待つ
+    if "[HIDDEN:".startswith(stripped):
+        return None
+    return text
+
+def stream_visible_response(chunks, placeholder, spinner=None) -> str:
+    """
+    LLMの応答を受信しながら表面的な発言部分だけを逐次表示し、応答全文を返す
+    （[HIDDEN:...] の本音は表示しない。最初の表示時に考え中アニメーションを閉じる）
+    """
+    full_text = ""
+    for chunk in chunks:
+        full_text += chunk
+        visible = _visible_part(full_text)
+        if not visible:
+            continue
+        if spinner is not None:
+            spinner.empty()
+            spinner = None
+        with placeholder.container():
+            with st.chat_message("assistant"):
+                st.markdown(visible + "▌")
+    return full_text
+
 def render_custom_chat_history(messages, chat_interface):
     """カスタムチャット履歴表示エリア（マスク機能付き）"""
     if not messages:
         st.info("まだメッセージがありません。下のチャット欄で麻理に話しかけてみてください。")
         return
     
-    # デバッグ: 初期メッセージの存在確認
-    initial_messages = [msg for msg in messages if msg.get('is_initial', False)]
-    if initial_messages:
-        logger.debug(f"初期メッセージ確認: {len(initial_messages)}件 - 内容: '{initial_messages[0].get('content', '')}'")
-    else:
+    # 初期メッセージの存在確認（通常は先頭にあるため最初の一致で打ち切る）
+    initial_message = next((msg for msg in messages if msg.get('is_initial', False)), None)
+    if initial_message is None:
         logger.warning("初期メッセージが見つかりません")
+    else:
+        logger.debug("初期メッセージ確認 - 内容: '%s'", initial_message.get('content', ''))
     
     # 拡張されたチャットインターフェースを使用（マスク機能付き）
     chat_interface.render_chat_history(messages)
 
 
+@st.fragment
+def render_debug_panel(managers):
+    """
+    デバッグ情報パネルの中身を描画する（デバッグモード時のみ使用）
+    フラグメントとして実行し、パネル内の操作ではアプリ全体を再実行しない
+    """
+    # SessionManagerから詳細情報を取得
+    session_manager = get_session_manager()
+    # 各項目を何度も参照するため、属性アクセスできる形で一度だけ取得する
+    session_info = SimpleNamespace(**session_manager.get_session_info())
+    memory_manager = st.session_state.memory_manager
+    memory_manager_id = id(memory_manager)
+    
+    # 検証履歴と復旧履歴を取得
+    validation_history = session_manager.get_validation_history(limit=10)
+    recovery_history = session_manager.get_recovery_history(limit=10)
+    
+    # Cookie状態を取得
+    session_api_client = managers.get("session_api_client")
+    cookie_status = session_api_client.get_cookie_status() if session_api_client else {}
+    
+    # タブ形式でデバッグ情報を整理（拡張版）
+    debug_tab1, debug_tab2, debug_tab3, debug_tab4, debug_tab5, debug_tab6 = st.tabs([
+        "🔍 セッション分離", "📊 基本情報", "🍪 Cookie状態", "✅ 検証履歴", "🔧 復旧履歴", "⚙️ システム詳細"
+    ])
+    
+    with debug_tab1:
+        st.markdown("### 🔒 セッション分離状態")
+        
+        # 手動検証ボタン
+        col_btn1, col_btn2, col_btn3 = st.columns(3)
+        with col_btn1:
+            if st.button("🔍 手動検証実行", help="セッション整合性を手動で検証します"):
+                validation_result = validate_session_state()
+                # 直後の再実行で消えないよう、トーストで結果を通知する
+                if validation_result:
+                    st.toast("✅ セッション検証成功")
+                else:
+                    st.toast("❌ セッション検証失敗")
+                st.rerun(scope="fragment")
+        
+        with col_btn2:
+            if st.button("📋 詳細検証実行", help="詳細なセッション検証を実行します"):
+                detailed_issues = perform_detailed_session_validation(session_manager)
+                if not detailed_issues:
+                    st.success("✅ 詳細検証: 問題なし")
+                else:
+                    st.warning(f"⚠️ 詳細検証: {len(detailed_issues)}件の問題を検出")
+                    for issue in detailed_issues:
+                        severity_icon = "🔴" if issue['severity'] == 'critical' else "🟡"
+                        st.write(f"{severity_icon} **{issue['type']}**: {issue['description']}")
+        
+        with col_btn3:
+            if st.button("🔄 強制復旧実行", help="セッション状態を強制的に復旧します"):
+                session_manager.recover_session()
+                st.toast("🔄 セッション復旧を実行しました")
+                st.rerun(scope="fragment")
+        
+        st.markdown("---")
+        
+        # セッション分離詳細情報を構築（このタブでしか使わないためここで組み立てる）
+        isolation_status = session_manager.get_isolation_status()
+        session_isolation_details = {
+            "session_integrity": {
+                "status": "✅ 正常" if session_info.is_consistent else "❌ 不整合",
+                "session_id_match": session_info.session_id == session_info.current_session_id,
+                "original_session_id": session_info.session_id,
+                "current_session_id": session_info.current_session_id,
+                "stored_session_id": session_info.stored_session_id,
+                "user_id": session_info.user_id,
+                "session_age_minutes": round(session_info.session_age_seconds / 60, 2),
+                "last_validated": session_info.last_validated
+            },
+            "validation_metrics": {
+                "total_validations": session_info.validation_count,
+                "total_recoveries": session_info.recovery_count,
+                "validation_history_size": session_info.validation_history_count,
+                "recovery_history_size": session_info.recovery_history_count,
+                "success_rate": round((session_info.validation_count - session_info.recovery_count) / max(session_info.validation_count, 1) * 100, 2) if session_info.validation_count > 0 else 100
+            },
+            "component_isolation": isolation_status["component_isolation"],
+            "data_integrity": isolation_status["data_integrity"]
+        }
+        
+        # セッション整合性ステータス
+        col1, col2 = st.columns(2)
+        with col1:
+            st.metric(
+                "セッション整合性",
+                session_isolation_details["session_integrity"]["status"],
+                delta=None
+            )
+            st.metric(
+                "検証成功率",
+                f"{session_isolation_details['validation_metrics']['success_rate']}%",
+                delta=None
+            )
+        
+        with col2:
+            st.metric(
+                "総検証回数",
+                session_isolation_details["validation_metrics"]["total_validations"],
+                delta=None
+            )
+            st.metric(
+                "復旧実行回数",
+                session_isolation_details["validation_metrics"]["total_recoveries"],
+                delta=None
+            )
+        
+        # コンポーネント分離状態
+        st.markdown("#### 🧩 コンポーネント分離状態")
+        isolation_data = session_isolation_details["component_isolation"]
+        
+        for component, is_isolated in isolation_data.items():
+            status_icon = "✅" if is_isolated else "❌"
+            component_name = {
+                "chat_isolated": "チャット機能",
+                "memory_isolated": "メモリ管理",
+                "notifications_isolated": "通知システム",
+                "rate_limit_isolated": "レート制限"
+            }.get(component, component)
+            
+            st.write(f"{status_icon} **{component_name}**: {'分離済み' if is_isolated else '未分離'}")
+        
+        # データ整合性
+        st.markdown("#### 📋 データ整合性")
+        integrity_data = session_isolation_details["data_integrity"]
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            st.metric("チャットメッセージ数", integrity_data["chat_messages_count"])
+            st.metric("メモリキャッシュサイズ", integrity_data["memory_cache_size"])
+        
+        with col2:
+            st.metric("特別な記憶数", integrity_data["special_memories_count"])
+            st.metric("保留中通知数", integrity_data["pending_total"])
+        
+        # セッションID詳細
+        st.markdown("#### 🆔 セッションID詳細")
+        session_id_info = session_isolation_details["session_integrity"]
+        
+        st.text(_SESSION_ID_DETAIL_TMPL.format_map(session_id_info))
+    
+    with debug_tab2:
+        st.markdown("### 📊 基本セッション情報")
+        st.json({
+            "session_manager": {
+                "session_id": session_info.session_id,
+                "current_session_id": session_info.current_session_id,
+                "user_id": session_info.user_id,
+                "is_consistent": session_info.is_consistent,
+                "validation_count": session_info.validation_count,
+                "recovery_count": session_info.recovery_count,
+                "session_age_seconds": session_info.session_age_seconds,
+                "created_at": session_info.created_at,
+                "last_validated": session_info.last_validated
+            },
+            "chat_state": {
+                "affection": st.session_state.chat['affection'],
+                "theme": st.session_state.chat['scene_params']['theme'],
+                "messages_count": len(st.session_state.chat['messages']),
+                "ura_mode": st.session_state.chat.get('ura_mode', False),
+                "limiter_state_present": 'limiter_state' in st.session_state.chat,
+                "scene_change_pending": st.session_state.chat.get('scene_change_pending')
+            },
+            "memory_state": {
+                "cache_size": len(memory_manager.important_words_cache),
+                "special_memories": len(memory_manager.special_memories),
+                "memory_manager_type": type(memory_manager).__name__,
+                "memory_manager_id": memory_manager_id
+            }
+        })
+    
+    with debug_tab3:
+        st.markdown("### 🍪 Cookie状態")
+        
+        if cookie_status:
+            # Cookie概要
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                st.metric("Cookie数", cookie_status.get('count', 0))
+            with col2:
+                has_session = cookie_status.get('has_session_cookie', False)
+                st.metric("セッションCookie", "✅ あり" if has_session else "❌ なし")
+            with col3:
+                if st.button("🔄 Cookie状態更新", help="Cookie状態を再取得します"):
+                    st.rerun(scope="fragment")
+            
+            # Cookie詳細
+            if cookie_status.get('cookies'):
+                st.markdown("#### Cookie詳細")
+                for i, cookie in enumerate(cookie_status['cookies']):
+                    with st.expander(f"Cookie {i+1}: {cookie.get('name', 'unknown')}"):
+                        st.json(cookie)
+            else:
+                st.info("現在Cookieは設定されていません")
+            
+            # Cookie操作ボタン
+            st.markdown("#### Cookie操作")
+            col_cookie1, col_cookie2 = st.columns(2)
+            with col_cookie1:
+                if st.button("🗑️ Cookie削除テスト", help="Cookieを削除してテストします"):
+                    try:
+                        session_api_client.session.cookies.clear()
+                        st.success("Cookie削除完了")
+                        st.rerun()
+                    except Exception as e:
+                        st.error(f"Cookie削除エラー: {e}")
+            
+            with col_cookie2:
+                if st.button("🔥 フルリセットテスト", help="フルリセット機能をテストします"):
+                    try:
+                        reset_result = session_api_client.full_reset_session()
+                        if reset_result['success']:
+                            st.success(f"フルリセット成功: {reset_result['message']}")
+                        else:
+                            st.error(f"フルリセット失敗: {reset_result['message']}")
+                        st.json(reset_result)
+                    except Exception as e:
+                        st.error(f"フルリセットテストエラー: {e}")
+        else:
+            st.warning("Cookie状態を取得できませんでした")
+    
+    with debug_tab4:
+        st.markdown("### ✅ セッション検証履歴")
+        if validation_history:
+            st.write(f"**最新の検証履歴（最大10件）:** 総検証回数 {session_info.validation_count} 回")
+            
+            # 検証履歴のサマリー
+            recent_validations = validation_history[-5:] if len(validation_history) >= 5 else validation_history
+            success_count = sum(1 for v in recent_validations if v['is_consistent'])
+            
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                st.metric("直近5回の成功率", f"{success_count}/{len(recent_validations)}")
+            with col2:
+                st.metric("最新検証結果", "✅ 成功" if validation_history[-1]['is_consistent'] else "❌ 失敗")
+            with col3:
+                st.metric("検証間隔", f"約{round((time.time() - validation_history[-1]['timestamp_epoch']) / 60, 1)}分前")
+            
+            # 詳細な検証履歴（新しい順に1つの表で表示）
+            st.dataframe(
+                [
+                    {
+                        "検証回数": record['validation_count'],
+                        "検証時刻": record['timestamp'][:19].replace('T', ' '),
+                        "結果": "✅ 整合性OK" if record['is_consistent'] else "❌ 不整合検出",
+                        "ユーザーID": record['user_id'],
+                        "オリジナルID": record['original_session_id'],
+                        "現在のID": record['current_session_id'],
+                        "保存済みID": record['stored_session_id'],
+                        "セッションキー数": record['session_keys_count'],
+                    }
+                    for record in reversed(validation_history)
+                ],
+                use_container_width=True,
+                hide_index=True
+            )
+        else:
+            st.info("検証履歴がありません")
+    
+    with debug_tab4:
+        st.markdown("### 🔧 セッション復旧履歴")
+        if recovery_history:
+            st.write(f"**復旧履歴:** 総復旧回数 {session_info.recovery_count} 回")
+            
+            # 復旧履歴のサマリー
+            if recovery_history:
+                last_recovery = recovery_history[-1]
+                time_since_recovery = (time.time() - last_recovery['timestamp_epoch']) / 60
+                
+                col1, col2 = st.columns(2)
+                with col1:
+                    st.metric("最新復旧", f"約{round(time_since_recovery, 1)}分前")
+                with col2:
+                    st.metric("復旧タイプ", last_recovery.get('recovery_type', 'unknown'))
+            
+            # 詳細な復旧履歴（新しい順に1つの表で表示）
+            st.dataframe(
+                [
+                    {
+                        "復旧回数": record['recovery_count'],
+                        "復旧時刻": record['timestamp'][:19].replace('T', ' '),
+                        "復旧タイプ": record.get('recovery_type', 'unknown'),
+                        "ユーザーID": record['user_id'],
+                        "変更前ID": record['old_session_id'],
+                        "変更後ID": record['new_session_id'],
+                        "セッションキー数": record['session_keys_count'],
+                        "復旧時検証回数": record['validation_count_at_recovery'],
+                    }
+                    for record in reversed(recovery_history)
+                ],
+                use_container_width=True,
+                hide_index=True
+            )
+        else:
+            st.success("復旧履歴がありません（正常な状態です）")
+    
+    with debug_tab5:
+        st.markdown("### 🔧 復旧履歴")
+        if recovery_history:
+            st.write(f"**復旧履歴（最大10件）:** 総復旧回数 {session_info.recovery_count} 回")
+            
+            # 復旧履歴のサマリー
+            recent_recoveries = recovery_history[-5:] if len(recovery_history) >= 5 else recovery_history
+            
+            col1, col2 = st.columns(2)
+            with col1:
+                st.metric("直近の復旧回数", len(recent_recoveries))
+            with col2:
+                if recent_recoveries:
+                    last_recovery = recent_recoveries[-1]
+                    st.metric("最終復旧", last_recovery['timestamp'][:19])
+            
+            # 復旧履歴の詳細表示
+            for i, recovery in enumerate(reversed(recovery_history)):
+                with st.expander(f"復旧 #{len(recovery_history)-i}: {recovery['timestamp'][:19]}"):
+                    st.json(recovery)
+        else:
+            st.success("復旧履歴がありません（正常な状態です）")
+    
+    with debug_tab6:
+        st.markdown("### ⚙️ システム詳細情報")
+        session_keys = list(st.session_state.keys())
+        st.json({
+            "session_keys": session_keys,
+            "session_keys_count": len(session_keys),
+            "notifications_pending": {
+                "affection": len(st.session_state.affection_notifications),
+                "memory": len(st.session_state.memory_notifications)
+            },
+            "streamlit_session_id": st.session_state.get('_session_id', 'unknown')
+        })
+        
+        
+        # ポチ機能の統計（本格実装）
+        st.markdown("---")
+        st.markdown("### 🐕 ポチ機能統計")
+        flip_states = st.session_state.get('message_flip_states', {})
+        flipped_count = sum(1 for flipped in flip_states.values() if flipped)
+        st.markdown(f"**フリップ状態数**: {len(flip_states)}（表示中: {flipped_count}）")
+        # 全件のダンプは会話が長いほど重くなるため、明示的に要求された場合のみ表示
+        if flip_states and st.checkbox("フリップ状態の詳細を表示", value=False, key="_debug_show_flip_states"):
+            st.json(flip_states)
+        
+        # 追加のシステム情報
+        st.markdown("#### 🔧 技術詳細")
+        st.text(_TECH_DETAIL_TMPL.format(
+            session_state_id=id(st.session_state),
+            session_manager_id=id(session_manager),
+            memory_manager_id=memory_manager_id,
+            debug_mode=Config.DEBUG_MODE,
+            force_session_reset=Config.FORCE_SESSION_RESET,
+            session_keys_count=len(session_keys),
+            internal_session_id=st.session_state.get('_session_id', 'unknown')
+        ))
+
+def toggle_safety_mode(tutorial_manager):
+    """セーフティ機能（裏モード）を切り替える（ボタンのコールバック）"""
+    new_mode = not st.session_state.chat.get('ura_mode', False)
+    st.session_state.chat['ura_mode'] = new_mode
+    
+    # チュートリアルステップ3を完了
+    tutorial_manager.check_step_completion(3, True)
+    
+    if new_mode:
+        st.toast("🔓 セーフティ解除モードに切り替えました！")
+    else:
+        st.toast("🔒 セーフティ有効モードに戻しました。")
+
 # === チャットタブの描画関数 ===
 def render_chat_tab(managers):
     """「麻理と話す」タブのUIを描画する"""
@@ -769,60 +1371,17 @@ def render_chat_tab(managers):
         safety_text = "セーフティ解除" if current_mode else "セーフティ有効"
         safety_icon = "🔓" if current_mode else "🔒"
         
-        # セーフティボタンのカスタムCSS
-        safety_css = f"""
-        <style>
-        .safety-button {{
-            background-color: {safety_color};
-            color: white;
-            border: none;
-            border-radius: 8px;
-            padding: 10px 15px;
-            font-size: 16px;
-            font-weight: bold;
-            cursor: pointer;
-            width: 100%;
-            margin-bottom: 15px;
-            transition: all 0.3s ease;
-            box-shadow: 0 2px 4px rgba(0,0,0,0.2);
-        }}
-        .safety-button:hover {{
-            transform: translateY(-2px);
-            box-shadow: 0 4px 8px rgba(0,0,0,0.3);
-        }}
-        </style>
-        """
-        st.markdown(safety_css, unsafe_allow_html=True)
+        # サイドバーのカスタムCSS（静的部分は定数、モードで変わる色だけを差分として出力）
+        st.markdown(_SIDEBAR_CSS + _SAFETY_COLOR_CSS_TMPL.format(color=safety_color), unsafe_allow_html=True)
         
-        if st.button(f"{safety_icon} {safety_text}", type="primary" if current_mode else "secondary", 
-                    help="麻理のセーフティ機能を切り替えます", use_container_width=True):
-            st.session_state.chat['ura_mode'] = not current_mode
-            new_mode = st.session_state.chat['ura_mode']
-            
-            # チュートリアルステップ3を完了
-            tutorial_manager.check_step_completion(3, True)
-            
-            if new_mode:
-                st.success("🔓 セーフティ解除モードに切り替えました！")
-            else:
-                st.info("🔒 セーフティ有効モードに戻しました。")
-            st.rerun()
+        # 切り替えはコールバックで行い、ボタン押下による1回の再実行で新しい状態を描画する
+        st.button(f"{safety_icon} {safety_text}", type="primary" if current_mode else "secondary", 
+                  help="麻理のセーフティ機能を切り替えます", use_container_width=True,
+                  on_click=toggle_safety_mode, args=(tutorial_manager,))
 
         with st.expander("📊 ステータス", expanded=True):
             affection = st.session_state.chat['affection']
             
-            # 好感度の文字を白くするためのCSS
-            affection_css = """
-            <style>
-            .affection-label {
-                color: white !important;
-                font-weight: bold;
-                font-size: 16px;
-                margin-bottom: 10px;
-            }
-            </style>
-            """
-            st.markdown(affection_css, unsafe_allow_html=True)
             st.markdown('<div class="affection-label">好感度</div>', unsafe_allow_html=True)
             
             st.metric(label="", value=f"{affection} / 100")
@@ -837,23 +1396,6 @@ def render_chat_tab(managers):
 
 
         with st.expander("⚙️ 設定"):
-            # 設定ボタン内の表示を大きくするCSS
-            settings_css = """
-            <style>
-            .settings-content {
-                font-size: 18px !important;
-            }
-            .settings-content .stButton > button {
-                font-size: 18px !important;
-                padding: 12px 20px !important;
-                height: auto !important;
-            }
-            .settings-content .stButton > button div {
-                font-size: 18px !important;
-            }
-            </style>
-            """
-            st.markdown(settings_css, unsafe_allow_html=True)
             
             # 設定コンテンツをラップ
             st.markdown('<div class="settings-content">', unsafe_allow_html=True)
@@ -861,11 +1403,12 @@ def render_chat_tab(managers):
             # ... (エクスポートやリセットボタンのロジックは省略) ...
             if st.button("🔄 会話をリセット", type="secondary", use_container_width=True, help="あなたの会話履歴のみをリセットします（他のユーザーには影響しません）"):
                 # チャット履歴を完全にリセット
-                st.session_state.chat['messages'] = [{"role": "assistant", "content": "何の用？遊びに来たの？", "is_initial": True}]
+                st.session_state.chat['messages'] = [dict(_INITIAL_MESSAGE)]
                 st.session_state.chat['affection'] = 30
                 st.session_state.chat['scene_params'] = {"theme": "default"}
-                st.session_state.chat['limiter_state'] = managers['rate_limiter'].create_limiter_state()
+                managers['rate_limiter'].reset_limiter(st.session_state.chat['limiter_state'])
                 st.session_state.chat['ura_mode'] = False  # 裏モードもリセット
+                st.session_state.chat['recent_turns'] = deque(maxlen=CONTEXT_HISTORY_TURNS)
                 
                 # メモリマネージャーをクリア
                 st.session_state.memory_manager.clear_memory()
@@ -873,10 +1416,6 @@ def render_chat_tab(managers):
                 # Streamlitの内部チャット状態もクリア
                 if 'messages' in st.session_state:
                     del st.session_state.messages
-                if 'last_sent_message' in st.session_state:
-                    del st.session_state.last_sent_message
-                if 'user_message_input' in st.session_state:
-                    del st.session_state.user_message_input
                 if 'message_flip_states' in st.session_state:
                     del st.session_state.message_flip_states
                 
@@ -936,8 +1475,7 @@ def render_chat_tab(managers):
                                 if key not in ['_session_id', 'session_info']:  # 必要なキーは保持
                                     del st.session_state[key]
                             
-                            # CSS読み込みフラグもリセット
-                            st.session_state.css_loaded = False
+                            # 背景テーマの記録もリセット
                             st.session_state.last_background_theme = ''
                             st.session_state._initialization_complete = False
                             
@@ -1008,385 +1546,9 @@ def render_chat_tab(managers):
 
         if st.session_state.debug_mode:
             with st.expander("🛠️ デバッグ情報", expanded=False):
-                # SessionManagerから詳細情報を取得
-                session_manager = get_session_manager()
-                session_info = session_manager.get_session_info()
-                isolation_status = session_manager.get_isolation_status()
-                
-                # 検証履歴と復旧履歴を取得
-                validation_history = session_manager.get_validation_history(limit=10)
-                recovery_history = session_manager.get_recovery_history(limit=10)
-                
-                # セッション分離詳細情報を構築
-                session_isolation_details = {
-                    "session_integrity": {
-                        "status": "✅ 正常" if session_info["is_consistent"] else "❌ 不整合",
-                        "session_id_match": session_info["session_id"] == session_info["current_session_id"],
-                        "original_session_id": session_info["session_id"],
-                        "current_session_id": session_info["current_session_id"],
-                        "stored_session_id": session_info["stored_session_id"],
-                        "user_id": session_info["user_id"],
-                        "session_age_minutes": round(session_info["session_age_seconds"] / 60, 2),
-                        "last_validated": session_info["last_validated"]
-                    },
-                    "validation_metrics": {
-                        "total_validations": session_info["validation_count"],
-                        "total_recoveries": session_info["recovery_count"],
-                        "validation_history_size": session_info["validation_history_count"],
-                        "recovery_history_size": session_info["recovery_history_count"],
-                        "success_rate": round((session_info["validation_count"] - session_info["recovery_count"]) / max(session_info["validation_count"], 1) * 100, 2) if session_info["validation_count"] > 0 else 100
-                    },
-                    "component_isolation": isolation_status["component_isolation"],
-                    "data_integrity": isolation_status["data_integrity"]
-                }
-                
-                # FastAPIセッション状態を取得
-                session_api_client = managers.get("session_api_client")
-                api_session_status = session_api_client.get_session_status() if session_api_client else {}
-                
-                # Cookie状態を取得
-                cookie_status = session_api_client.get_cookie_status() if session_api_client else {}
-                
-                # 拡張されたデバッグ情報
-                enhanced_debug_info = {
-                    "session_isolation_details": session_isolation_details,
-                    "isolation_status": isolation_status,
-                    "session_manager_info": {
-                        "session_id": session_info["session_id"],
-                        "current_session_id": session_info["current_session_id"],
-                        "user_id": session_info["user_id"],
-                        "is_consistent": session_info["is_consistent"],
-                        "validation_count": session_info["validation_count"],
-                        "recovery_count": session_info["recovery_count"],
-                        "session_age_seconds": session_info["session_age_seconds"],
-                        "created_at": session_info["created_at"],
-                        "last_validated": session_info["last_validated"]
-                    },
-                    "fastapi_session_info": api_session_status,
-                    "cookie_status": cookie_status,
-                    "chat_state": {
-                        "affection": st.session_state.chat['affection'],
-                        "theme": st.session_state.chat['scene_params']['theme'],
-                        "messages_count": len(st.session_state.chat['messages']),
-                        "ura_mode": st.session_state.chat.get('ura_mode', False),
-                        "limiter_state_present": 'limiter_state' in st.session_state.chat,
-                        "scene_change_pending": st.session_state.chat.get('scene_change_pending')
-                    },
-                    "memory_state": {
-                        "cache_size": len(st.session_state.memory_manager.important_words_cache),
-                        "special_memories": len(st.session_state.memory_manager.special_memories),
-                        "memory_manager_type": type(st.session_state.memory_manager).__name__,
-                        "memory_manager_id": id(st.session_state.memory_manager)
-                    },
-                    "system_state": {
-                        "session_keys": list(st.session_state.keys()),
-                        "session_keys_count": len(st.session_state.keys()),
-                        "notifications_pending": {
-                            "affection": len(st.session_state.affection_notifications),
-                            "memory": len(st.session_state.memory_notifications)
-                        },
-                        "streamlit_session_id": st.session_state.get('_session_id', 'unknown')
-                    }
-                }
-                
-                # タブ形式でデバッグ情報を整理（拡張版）
-                debug_tab1, debug_tab2, debug_tab3, debug_tab4, debug_tab5, debug_tab6 = st.tabs([
-                    "🔍 セッション分離", "📊 基本情報", "🍪 Cookie状態", "✅ 検証履歴", "🔧 復旧履歴", "⚙️ システム詳細"
-                ])
-                
-                with debug_tab1:
-                    st.markdown("### 🔒 セッション分離状態")
-                    
-                    # 手動検証ボタン
-                    col_btn1, col_btn2, col_btn3 = st.columns(3)
-                    with col_btn1:
-                        if st.button("🔍 手動検証実行", help="セッション整合性を手動で検証します"):
-                            validation_result = validate_session_state()
-                            if validation_result:
-                                st.success("✅ セッション検証成功")
-                            else:
-                                st.error("❌ セッション検証失敗")
-                            st.rerun()
-                    
-                    with col_btn2:
-                        if st.button("📋 詳細検証実行", help="詳細なセッション検証を実行します"):
-                            detailed_issues = perform_detailed_session_validation(session_manager)
-                            if not detailed_issues:
-                                st.success("✅ 詳細検証: 問題なし")
-                            else:
-                                st.warning(f"⚠️ 詳細検証: {len(detailed_issues)}件の問題を検出")
-                                for issue in detailed_issues:
-                                    severity_icon = "🔴" if issue['severity'] == 'critical' else "🟡"
-                                    st.write(f"{severity_icon} **{issue['type']}**: {issue['description']}")
-                    
-                    with col_btn3:
-                        if st.button("🔄 強制復旧実行", help="セッション状態を強制的に復旧します"):
-                            session_manager.recover_session()
-                            st.info("🔄 セッション復旧を実行しました")
-                            st.rerun()
-                    
-                    st.markdown("---")
-                    
-                    # セッション整合性ステータス
-                    col1, col2 = st.columns(2)
-                    with col1:
-                        st.metric(
-                            "セッション整合性",
-                            session_isolation_details["session_integrity"]["status"],
-                            delta=None
-                        )
-                        st.metric(
-                            "検証成功率",
-                            f"{session_isolation_details['validation_metrics']['success_rate']}%",
-                            delta=None
-                        )
-                    
-                    with col2:
-                        st.metric(
-                            "総検証回数",
-                            session_isolation_details["validation_metrics"]["total_validations"],
-                            delta=None
-                        )
-                        st.metric(
-                            "復旧実行回数",
-                            session_isolation_details["validation_metrics"]["total_recoveries"],
-                            delta=None
-                        )
-                    
-                    # コンポーネント分離状態
-                    st.markdown("#### 🧩 コンポーネント分離状態")
-                    isolation_data = session_isolation_details["component_isolation"]
-                    
-                    for component, is_isolated in isolation_data.items():
-                        status_icon = "✅" if is_isolated else "❌"
-                        component_name = {
-                            "chat_isolated": "チャット機能",
-                            "memory_isolated": "メモリ管理",
-                            "notifications_isolated": "通知システム",
-                            "rate_limit_isolated": "レート制限"
-                        }.get(component, component)
-                        
-                        st.write(f"{status_icon} **{component_name}**: {'分離済み' if is_isolated else '未分離'}")
-                    
-                    # データ整合性
-                    st.markdown("#### 📋 データ整合性")
-                    integrity_data = session_isolation_details["data_integrity"]
-                    
-                    col1, col2 = st.columns(2)
-                    with col1:
-                        st.metric("チャットメッセージ数", integrity_data["chat_messages_count"])
-                        st.metric("メモリキャッシュサイズ", integrity_data["memory_cache_size"])
-                    
-                    with col2:
-                        st.metric("特別な記憶数", integrity_data["special_memories_count"])
-                        pending_total = sum(integrity_data["pending_notifications"].values())
-                        st.metric("保留中通知数", pending_total)
-                    
-                    # セッションID詳細
-                    st.markdown("#### 🆔 セッションID詳細")
-                    session_id_info = session_isolation_details["session_integrity"]
-                    
-                    st.code(f"""
-セッション整合性: {session_id_info['status']}
-オリジナルID: {session_id_info['original_session_id']}
-現在のID: {session_id_info['current_session_id']}
-保存されたID: {session_id_info['stored_session_id']}
-ユーザーID: {session_id_info['user_id']}
-セッション継続時間: {session_id_info['session_age_minutes']} 分
-最終検証時刻: {session_id_info['last_validated'][:19]}
-                    """)
-                
-                with debug_tab2:
-                    st.markdown("### 📊 基本セッション情報")
-                    st.json({
-                        "session_manager": enhanced_debug_info["session_manager_info"],
-                        "chat_state": enhanced_debug_info["chat_state"],
-                        "memory_state": enhanced_debug_info["memory_state"]
-                    })
-                
-                with debug_tab3:
-                    st.markdown("### 🍪 Cookie状態")
-                    
-                    if cookie_status:
-                        # Cookie概要
-                        col1, col2, col3 = st.columns(3)
-                        with col1:
-                            st.metric("Cookie数", cookie_status.get('count', 0))
-                        with col2:
-                            has_session = cookie_status.get('has_session_cookie', False)
-                            st.metric("セッションCookie", "✅ あり" if has_session else "❌ なし")
-                        with col3:
-                            if st.button("🔄 Cookie状態更新", help="Cookie状態を再取得します"):
-                                st.rerun()
-                        
-                        # Cookie詳細
-                        if cookie_status.get('cookies'):
-                            st.markdown("#### Cookie詳細")
-                            for i, cookie in enumerate(cookie_status['cookies']):
-                                with st.expander(f"Cookie {i+1}: {cookie.get('name', 'unknown')}"):
-                                    st.json(cookie)
-                        else:
-                            st.info("現在Cookieは設定されていません")
-                        
-                        # Cookie操作ボタン
-                        st.markdown("#### Cookie操作")
-                        col_cookie1, col_cookie2 = st.columns(2)
-                        with col_cookie1:
-                            if st.button("🗑️ Cookie削除テスト", help="Cookieを削除してテストします"):
-                                try:
-                                    session_api_client.session.cookies.clear()
-                                    st.success("Cookie削除完了")
-                                    st.rerun()
-                                except Exception as e:
-                                    st.error(f"Cookie削除エラー: {e}")
-                        
-                        with col_cookie2:
-                            if st.button("🔥 フルリセットテスト", help="フルリセット機能をテストします"):
-                                try:
-                                    reset_result = session_api_client.full_reset_session()
-                                    if reset_result['success']:
-                                        st.success(f"フルリセット成功: {reset_result['message']}")
-                                    else:
-                                        st.error(f"フルリセット失敗: {reset_result['message']}")
-                                    st.json(reset_result)
-                                except Exception as e:
-                                    st.error(f"フルリセットテストエラー: {e}")
-                    else:
-                        st.warning("Cookie状態を取得できませんでした")
-                
-                with debug_tab4:
-                    st.markdown("### ✅ セッション検証履歴")
-                    if validation_history:
-                        st.write(f"**最新の検証履歴（最大10件）:** 総検証回数 {session_info['validation_count']} 回")
-                        
-                        # 検証履歴のサマリー
-                        recent_validations = validation_history[-5:] if len(validation_history) >= 5 else validation_history
-                        success_count = sum(1 for v in recent_validations if v['is_consistent'])
-                        
-                        col1, col2, col3 = st.columns(3)
-                        with col1:
-                            st.metric("直近5回の成功率", f"{success_count}/{len(recent_validations)}")
-                        with col2:
-                            st.metric("最新検証結果", "✅ 成功" if validation_history[-1]['is_consistent'] else "❌ 失敗")
-                        with col3:
-                            st.metric("検証間隔", f"約{round((datetime.now() - datetime.fromisoformat(validation_history[-1]['timestamp'].replace('Z', '+00:00').replace('+00:00', ''))).total_seconds() / 60, 1)}分前")
-                        
-                        # 詳細な検証履歴
-                        for i, record in enumerate(reversed(validation_history)):
-                            status_icon = "✅" if record['is_consistent'] else "❌"
-                            timestamp = record['timestamp'][:19].replace('T', ' ')
-                            
-                            with st.expander(f"{status_icon} 検証 #{record['validation_count']} - {timestamp}", expanded=(i==0)):
-                                col1, col2 = st.columns(2)
-                                
-                                with col1:
-                                    st.write("**基本情報:**")
-                                    st.write(f"- 検証時刻: {timestamp}")
-                                    st.write(f"- 検証回数: #{record['validation_count']}")
-                                    st.write(f"- 結果: {'✅ 整合性OK' if record['is_consistent'] else '❌ 不整合検出'}")
-                                    st.write(f"- ユーザーID: {record['user_id']}")
-                                
-                                with col2:
-                                    st.write("**セッションID情報:**")
-                                    st.write(f"- オリジナル: {record['original_session_id']}")
-                                    st.write(f"- 現在: {record['current_session_id']}")
-                                    st.write(f"- 保存済み: {record['stored_session_id']}")
-                                    st.write(f"- セッションキー数: {record['session_keys_count']}")
-                    else:
-                        st.info("検証履歴がありません")
-                
-                with debug_tab4:
-                    st.markdown("### 🔧 セッション復旧履歴")
-                    if recovery_history:
-                        st.write(f"**復旧履歴:** 総復旧回数 {session_info['recovery_count']} 回")
-                        
-                        # 復旧履歴のサマリー
-                        if recovery_history:
-                            last_recovery = recovery_history[-1]
-                            time_since_recovery = (datetime.now() - datetime.fromisoformat(last_recovery['timestamp'].replace('Z', '+00:00').replace('+00:00', ''))).total_seconds() / 60
-                            
-                            col1, col2 = st.columns(2)
-                            with col1:
-                                st.metric("最新復旧", f"約{round(time_since_recovery, 1)}分前")
-                            with col2:
-                                st.metric("復旧タイプ", last_recovery.get('recovery_type', 'unknown'))
-                        
-                        # 詳細な復旧履歴
-                        for record in reversed(recovery_history):
-                            timestamp = record['timestamp'][:19].replace('T', ' ')
-                            recovery_type = record.get('recovery_type', 'unknown')
-                            
-                            with st.expander(f"🔧 復旧 #{record['recovery_count']} - {timestamp} ({recovery_type})", expanded=True):
-                                col1, col2 = st.columns(2)
-                                
-                                with col1:
-                                    st.write("**復旧情報:**")
-                                    st.write(f"- 復旧時刻: {timestamp}")
-                                    st.write(f"- 復旧回数: #{record['recovery_count']}")
-                                    st.write(f"- 復旧タイプ: {recovery_type}")
-                                    st.write(f"- ユーザーID: {record['user_id']}")
-                                
-                                with col2:
-                                    st.write("**セッションID変更:**")
-                                    st.write(f"- 変更前: {record['old_session_id']}")
-                                    st.write(f"- 変更後: {record['new_session_id']}")
-                                    st.write(f"- セッションキー数: {record['session_keys_count']}")
-                                    st.write(f"- 復旧時検証回数: {record['validation_count_at_recovery']}")
-                    else:
-                        st.success("復旧履歴がありません（正常な状態です）")
-                
-                with debug_tab5:
-                    st.markdown("### 🔧 復旧履歴")
-                    if recovery_history:
-                        st.write(f"**復旧履歴（最大10件）:** 総復旧回数 {session_info['recovery_count']} 回")
-                        
-                        # 復旧履歴のサマリー
-                        recent_recoveries = recovery_history[-5:] if len(recovery_history) >= 5 else recovery_history
-                        
-                        col1, col2 = st.columns(2)
-                        with col1:
-                            st.metric("直近の復旧回数", len(recent_recoveries))
-                        with col2:
-                            if recent_recoveries:
-                                last_recovery = recent_recoveries[-1]
-                                st.metric("最終復旧", last_recovery['timestamp'][:19])
-                        
-                        # 復旧履歴の詳細表示
-                        for i, recovery in enumerate(reversed(recovery_history)):
-                            with st.expander(f"復旧 #{len(recovery_history)-i}: {recovery['timestamp'][:19]}"):
-                                st.json(recovery)
-                    else:
-                        st.success("復旧履歴がありません（正常な状態です）")
-                
-                with debug_tab6:
-                    st.markdown("### ⚙️ システム詳細情報")
-                    st.json(enhanced_debug_info["system_state"])
-                    
-                    
-                    # ポチ機能の統計（本格実装）
-                    st.markdown("---")
-                    st.markdown("### 🐕 ポチ機能統計")
-                    flip_states = st.session_state.get('message_flip_states', {})
-                    st.markdown(f"**フリップ状態数**: {len(flip_states)}")
-                    if flip_states:
-                        st.json(flip_states)
-                    
-                    # 追加のシステム情報
-                    st.markdown("#### 🔧 技術詳細")
-                    st.code(f"""
-Python オブジェクトID:
-- st.session_state: {id(st.session_state)}
-- SessionManager: {id(session_manager)}
-- MemoryManager: {enhanced_debug_info['memory_state']['memory_manager_id']}
-
-環境変数:
-- DEBUG_MODE: {os.getenv('DEBUG_MODE', 'false')}
-- FORCE_SESSION_RESET: {os.getenv('FORCE_SESSION_RESET', 'false')}
-
-Streamlit情報:
-- セッション状態キー数: {len(st.session_state.keys())}
-- 内部セッションID: {st.session_state.get('_session_id', 'unknown')}
-                    """)
+                # 詳細情報の収集・描画はコストが高いため、明示的に要求された場合のみ実行
+                if st.checkbox("詳細なデバッグ情報を表示", key="_debug_expander_open"):
+                    render_debug_panel(managers)
 
     # --- メインコンテンツ ---
     st.title("💬 麻理チャット")
@@ -1394,20 +1556,13 @@ Streamlit情報:
     
     # 好感度変化の通知を表示
     if st.session_state.affection_notifications:
-        for notification in st.session_state.affection_notifications:
-            show_affection_notification(
-                notification["change_amount"],
-                notification["change_reason"],
-                notification["new_affection"],
-                notification.get("is_milestone", False)
-            )
+        show_affection_notifications(st.session_state.affection_notifications)
         # 通知を表示したらクリア
         st.session_state.affection_notifications = []
     
     # 特別な記憶の通知を表示
     if st.session_state.memory_notifications:
-        for notification in st.session_state.memory_notifications:
-            show_memory_notification(notification)
+        show_memory_notifications(st.session_state.memory_notifications)
         # 通知を表示したらクリア
         st.session_state.memory_notifications = []
     
@@ -1415,65 +1570,29 @@ Streamlit情報:
     col1, col2, col3 = st.columns([1, 2, 1])
     with col2:
         with st.expander("📖 初めてチャットする人へ", expanded=False):
-            st.markdown("""
-            ### 🤖 麻理について
-            麻理は感情を持つアンドロイドです。あなたとの会話を通じて関係性が変化していきます。
-            
-            ### 💝 好感度システム
-            - **会話の内容**によって好感度が上下します
-            - **優しい言葉**をかけると好感度が上がります
-            - **冷たい態度**だと好感度が下がることも...
-            - サイドバーで現在の好感度を確認できます
-            
-            ### 🐕 本音表示機能
-            特定の場所について話すと、背景が自動的に変わります：
-            - 🏖️ **ビーチ**や**海**の話 → 夕日のビーチ
-            - ⛩️ **神社**や**お参り**の話 → 神社の境内
-            - ☕ **カフェ**や**コーヒー**の話 → 午後のカフェ
-            - 🐠 **水族館**や**魚**の話 → 夜の水族館
-            - 🎆 **お祭り**や**花火**の話 → 夜祭り
-            
-            ### 💬 会話のコツ
-            1. **自然な会話**を心がけてください
-            2. **質問**をすると麻理が詳しく答えてくれます
-            3. **感情**を込めた言葉は特に反応が良いです
-            4. **200文字以内**でメッセージを送ってください
-            
-            ### ⚙️ 便利な機能
-            - **サイドバー**：好感度やシーン情報を確認
-            - **会話履歴**：過去の会話を振り返り
-            - **リセット機能**：新しい関係から始めたい時に
-            
-            ---
-            **準備ができたら、下のチャット欄で麻理に話しかけてみてください！** 😊
-            """)
+            st.markdown(_CHAT_TUTORIAL_MD)
     
     st.markdown("---")
     
     # カスタムチャット履歴表示エリア（マスク機能付き）
     render_custom_chat_history(st.session_state.chat['messages'], managers['chat_interface'])
+    
+    # 送信時の新しいメッセージを履歴の直下に描画するための領域
+    new_messages_area = st.container()
 
     # メッセージ処理ロジック
-    def process_chat_message(message: str):
+    def process_chat_message(message: str, stream_placeholder=None, spinner=None):
         try:
             # チュートリアルステップ1を完了（メッセージ送信）
             tutorial_manager.check_step_completion(1, True)
             
-            # セッション検証を処理開始時に実行
-            if not validate_session_state():
-                logger.error("Session validation failed at message processing start")
-                return "（申し訳ありません。システムに問題が発生しました。ページを再読み込みしてください。）"
-            
             # レート制限チェック
+            # 状態はその場で更新されるため、取得した辞書を再代入する必要はない
             if 'limiter_state' not in st.session_state.chat:
                 st.session_state.chat['limiter_state'] = managers['rate_limiter'].create_limiter_state()
             
-            limiter_state = st.session_state.chat['limiter_state']
-            if not managers['rate_limiter'].check_limiter(limiter_state):
-                st.session_state.chat['limiter_state'] = limiter_state
+            if not managers['rate_limiter'].check_limiter(st.session_state.chat['limiter_state']):
                 return "（…少し話すのが速すぎる。もう少し、ゆっくり話してくれないか？）"
-            
-            st.session_state.chat['limiter_state'] = limiter_state
 
             # 会話履歴を正しく構築（現在のメッセージは含まない）
             # 注意: この時点では現在のユーザーメッセージはまだ履歴に追加されていない
@@ -1481,35 +1600,17 @@ Streamlit情報:
             non_initial_messages = [msg for msg in st.session_state.chat['messages'] 
                                   if not msg.get('is_initial', False)]
             
-            # 会話ペアを時系列順に構築
-            history = []
-            user_msgs = []
-            assistant_msgs = []
-            
-            for msg in non_initial_messages:
-                if msg['role'] == 'user':
-                    user_msgs.append(msg['content'])
-                elif msg['role'] == 'assistant':
-                    assistant_msgs.append(msg['content'])
-            
-            # ユーザーとアシスタントのメッセージをペアにする（最大5ターン）
-            max_turns = min(5, min(len(user_msgs), len(assistant_msgs)))
-            for i in range(max_turns):
-                if i < len(user_msgs) and i < len(assistant_msgs):
-                    history.append((user_msgs[i], assistant_msgs[i]))
+            # 直近の会話ペア（最大CONTEXT_HISTORY_TURNSターン）はメッセージ追加時に更新済みのものを使う
+            history = list(st.session_state.chat['recent_turns'])
             
             # 初回の場合は空の履歴になる（これが正しい動作）
-            logger.info(f"📚 構築された履歴: {len(history)}ターン")
+            logger.info("📚 構築された履歴: %dターン", len(history))
             if st.session_state.get('debug_mode', False):
-                logger.info(f"🔍 全メッセージ数: {len(st.session_state.chat['messages'])}")
-                logger.info(f"🔍 非初期メッセージ数: {len(non_initial_messages)}")
-                logger.info(f"🔍 ユーザーメッセージ数: {len(user_msgs)}")
-                logger.info(f"🔍 アシスタントメッセージ数: {len(assistant_msgs)}")
+                logger.info("🔍 全メッセージ数: %d", len(st.session_state.chat['messages']))
+                logger.info("🔍 非初期メッセージ数: %d", len(non_initial_messages))
 
             # 好感度更新（初期メッセージを除外）
             old_affection = st.session_state.chat['affection']
-            non_initial_messages = [msg for msg in st.session_state.chat['messages'] 
-                                  if not msg.get('is_initial', False)]
             affection, change_amount, change_reason = managers['sentiment_analyzer'].update_affection(
                 message, st.session_state.chat['affection'], non_initial_messages
             )
@@ -1529,29 +1630,29 @@ Streamlit情報:
                 # 特定の好感度レベルに到達した時の特別な通知
                 milestone_reached = check_affection_milestone(old_affection, affection)
                 if milestone_reached:
+                    milestone_threshold, milestone_message = milestone_reached
                     milestone_notification = {
                         "change_amount": 0,  # マイルストーン通知は変化量0で特別扱い
-                        "change_reason": milestone_reached,
+                        "change_reason": milestone_message,
                         "new_affection": affection,
                         "old_affection": old_affection,
-                        "is_milestone": True
+                        "is_milestone": True,
+                        "milestone_threshold": milestone_threshold  # 演出済みの判定に使う、実際に越えた閾値
                     }
                     st.session_state.affection_notifications.append(milestone_notification)
             
             # シーン変更検知
             current_theme = st.session_state.chat['scene_params']['theme']
-            new_theme = managers['scene_manager'].detect_scene_change(history, current_theme=current_theme)
+            new_theme = run_async(managers['scene_manager'].detect_scene_change(history, current_theme=current_theme))
             
             instruction = None
             if new_theme:
-                logger.info(f"Scene change detected! From '{current_theme}' to '{new_theme}'.")
+                logger.info("Scene change detected! From '%s' to '%s'.", current_theme, new_theme)
                 st.session_state.chat['scene_params'] = managers['scene_manager'].update_scene_params(st.session_state.chat['scene_params'], new_theme)
                 instruction = managers['scene_manager'].get_scene_transition_message(current_theme, new_theme)
                 st.session_state.scene_change_flag = True
 
             # メモリ圧縮とサマリー取得（初期メッセージを除外）
-            non_initial_messages = [msg for msg in st.session_state.chat['messages'] 
-                                  if not msg.get('is_initial', False)]
             compressed_messages, important_words = st.session_state.memory_manager.compress_history(
                 non_initial_messages
             )
@@ -1564,69 +1665,103 @@ Streamlit情報:
                 logger.info("🧠 メモリサマリーは空です（初対面状態）")
             
             # 対話生成（隠された真実機能統合済み）
-            response = managers['dialogue_generator'].generate_dialogue(
+            dialogue_args = (
                 history, message, affection, stage_name, st.session_state.chat['scene_params'], instruction, memory_summary, st.session_state.chat['ura_mode']
             )
+            if stream_placeholder is not None:
+                # 受信した順に表面的な発言を表示し、最初の文字までの体感待ち時間を短縮
+                response = stream_visible_response(
+                    managers['dialogue_generator'].generate_dialogue_stream(*dialogue_args),
+                    stream_placeholder, spinner
+                )
+            else:
+                response = managers['dialogue_generator'].generate_dialogue(*dialogue_args)
             
             # デバッグ: AI応答の形式をチェック
             if response:
-                logger.info(f"🤖 AI応答: '{response[:100]}...'")
+                logger.info("🤖 AI応答: '%.100s...'", response)
                 if '[HIDDEN:' in response:
                     logger.info("✅ HIDDEN形式を検出")
                 else:
                     logger.warning("⚠️ HIDDEN形式が見つからない - フォールバック処理を実行")
                     # HIDDEN形式でない場合は、強制的にHIDDEN形式に変換
                     response = f"[HIDDEN:（本当の気持ちは...）]{response}"
-                    logger.info(f"🔧 フォールバック後: '{response[:100]}...'")
+                    logger.info("🔧 フォールバック後: '%.100s...'", response)
             
             return response if response else "[HIDDEN:（言葉が出てこない...）]…なんて言えばいいか分からない。"
         except Exception as e:
             logger.error(f"チャットメッセージ処理エラー: {e}", exc_info=True)
             return "（ごめん、システムの調子が悪いみたいだ。）"
 
-    # ユーザー入力処理（通常の入力フィールドを使用して二重表示を防止）
-    with st.container():
+    # ユーザー入力処理（フォーム送信は1回の送信につき1度だけ処理され、送信後に入力欄がクリアされる）
+    with st.form("chat_form", clear_on_submit=True, border=False):
         col_input, col_send = st.columns([0.85, 0.15])
         
         with col_input:
             user_input = st.text_input(
                 "メッセージ", 
                 placeholder="麻理に話しかける...",
-                key="user_message_input",
+                max_chars=MAX_INPUT_LENGTH,
                 label_visibility="collapsed"
             )
         
         with col_send:
-            send_button = st.button("送信", type="primary", use_container_width=True)
+            send_button = st.form_submit_button("送信", type="primary", use_container_width=True)
     
-    # 送信ボタンでメッセージ送信（Enterキー送信は無効化して重複を防止）
+    # 送信ボタン（またはEnterキー）でメッセージ送信
     if send_button and user_input and user_input.strip():
-        # 重複送信を防止
-        if st.session_state.get("last_sent_message") == user_input:
-            return
-        st.session_state.last_sent_message = user_input
-        
         if len(user_input) > MAX_INPUT_LENGTH:
             st.error(f"⚠️ メッセージは{MAX_INPUT_LENGTH}文字以内で入力してください。")
         else:
-            # 応答を生成（履歴追加前に実行）
-            with cute_thinking_spinner():
-                response = process_chat_message(user_input)
+            # 応答のストリーミング表示先（セッション検証に失敗した場合は使わない）
+            assistant_area = None
             
-            # 応答生成後に両方のメッセージを履歴に追加（メッセージIDを含む）
-            user_message_id = f"user_{len(st.session_state.chat['messages'])}"
-            assistant_message_id = f"assistant_{len(st.session_state.chat['messages']) + 1}"
+            # セッション検証は重い応答生成（とスピナー表示）の前に実行
+            if not validate_session_state():
+                logger.error("Session validation failed at message processing start")
+                response = "（申し訳ありません。システムに問題が発生しました。ページを再読み込みしてください。）"
+            else:
+                # ユーザーの発言を先に表示し、その下に麻理の応答を受信しながら表示する
+                with new_messages_area:
+                    managers['chat_interface'].render_message({"role": "user", "content": user_input})
+                assistant_area = new_messages_area.empty()
+                
+                # 応答を生成（履歴追加前に実行）
+                with cute_thinking_spinner() as spinner:
+                    response = process_chat_message(user_input, stream_placeholder=assistant_area, spinner=spinner)
+            
+            # 応答生成後に両方のメッセージを履歴に追加
+            # （履歴は上限で切り詰められ件数が一定になるため、メッセージIDは件数ではなくadd_messageのuuidで採番する）
+            managers['chat_interface'].add_message("user", user_input, st.session_state.chat['messages'])
+            managers['chat_interface'].add_message("assistant", response, st.session_state.chat['messages'])
+            st.session_state.chat['recent_turns'].append((user_input, response))
             
-            managers['chat_interface'].add_message("user", user_input, st.session_state.chat['messages'], user_message_id)
-            managers['chat_interface'].add_message("assistant", response, st.session_state.chat['messages'], assistant_message_id)
+            # 全体を再実行せず、追加したメッセージだけをその場で描画
+            # （応答はストリーミング表示をマスク機能付きの最終表示に置き換える）
+            if assistant_area is not None:
+                with assistant_area.container():
+                    managers['chat_interface'].render_message(st.session_state.chat['messages'][-1])
+            else:
+                with new_messages_area:
+                    for new_message in st.session_state.chat['messages'][-2:]:
+                        managers['chat_interface'].render_message(new_message)
             
-            # 入力フィールドをクリア（次回の再実行時に反映）
-            if 'user_message_input' in st.session_state:
-                del st.session_state.user_message_input
+            # 履歴の上限を超えた古いメッセージを削除
+            trim_chat_messages(st.session_state.chat['messages'])
             
-            # シーン変更があった場合はフラグをクリア
-            if st.session_state.get('scene_change_flag', False):
-                del st.session_state['scene_change_flag']
+            # 再実行しないため、今回の送信で発生した通知とシーン変更もその場で反映する
+            with new_messages_area:
+                if st.session_state.affection_notifications:
+                    show_affection_notifications(st.session_state.affection_notifications)
+                    st.session_state.affection_notifications = []
+                if st.session_state.memory_notifications:
+                    show_memory_notifications(st.session_state.memory_notifications)
+                    st.session_state.memory_notifications = []
+                
+                # シーン変更があった場合は新しいテーマの背景を出力し、フラグをクリア
+                if st.session_state.get('scene_change_flag', False):
+                    update_background(managers['scene_manager'], st.session_state.chat['scene_params']['theme'])
+                    st.session_state.scene_change_flag = False
             
             # st.rerun()を削除 - Streamlitは自動的に再描画される
     
@@ -1710,8 +1845,138 @@ def generate_tutorial_letter(theme: str, managers) -> str:
         stage_name = managers['sentiment_analyzer'].get_relationship_stage(current_affection)
         return run_async(generate_tutorial_letter_fallback(theme, current_affection, stage_name))
 
+# 手紙関連のキャッシュは、ユーザーIDに加えて以下の値をキーに含めて無効化する
+# - cache_rev: このセッションでの操作（リクエスト送信・会話への反映）のたびに進める版数
+# - status_token: リクエスト状況（処理済みになった等）が変わると変化する値
+# .clear() は全ユーザーのキャッシュを消してしまうため使わない（古いエントリはTTLで破棄される）
+
+@st.cache_data(ttl=30, show_spinner=False)
+def _cached_request_status(user_id: str, cache_rev: int) -> dict:
+    """ユーザーのリクエスト状況を短時間キャッシュして取得する"""
+    request_manager = initialize_all_managers()['request_manager']
+    return run_async(request_manager.get_user_request_status(user_id))
+
+@st.cache_data(ttl=300, show_spinner=False)
+def _cached_letter_history(user_id: str, limit: int, cache_rev: int, status_token: tuple) -> list:
+    """ユーザーの手紙履歴をキャッシュして取得する（手紙の更新は1日1回程度のため）"""
+    user_manager = initialize_all_managers()['user_manager']
+    history = run_async(user_manager.get_user_letter_history(user_id, limit=limit))
+    # 描画ループで毎回組み立てないよう、エクスパンダーの見出しを先に作っておく
+    for letter_info in history:
+        letter_info["display_title"] = (
+            f"{letter_info.get('date')} - テーマ: {letter_info.get('theme')} ({letter_info.get('status', 'unknown')})"
+        )
+    return history
+
+@st.cache_data(ttl=300, show_spinner=False)
+def _cached_letter_contents(user_id: str, cache_rev: int, status_token: tuple) -> dict:
+    """ユーザーの手紙本文を日付ごとの辞書としてキャッシュして取得する"""
+    user_manager = initialize_all_managers()['user_manager']
+    user_data = run_async(user_manager.storage.get_user_data(user_id))
+    return {
+        date: letter.get("content")
+        for date, letter in (user_data or {}).get("letters", {}).items()
+    }
+
+def _letter_cache_rev() -> int:
+    """このセッションの手紙キャッシュの版数を取得する"""
+    return st.session_state.get('letter_cache_rev', 0)
+
+def _letter_status_token(request_status: dict) -> tuple:
+    """リクエスト状況のうち、手紙履歴・本文の内容に影響する値をキャッシュキー用にまとめる"""
+    return (request_status.get("date"), request_status.get("status"), request_status.get("processed_at"))
+
+def clear_letter_caches():
+    """このユーザーの手紙関連のキャッシュを無効化する（版数を進め、他のユーザーのキャッシュには触れない）"""
+    st.session_state.letter_cache_rev = _letter_cache_rev() + 1
+
+def render_tutorial_letter(tutorial_letter: dict):
+    """チュートリアルで生成した手紙を表示する（会話に反映するまで手紙タブに残す）"""
+    st.success("✉️ 麻理からの手紙が届きました！")
+
+    with st.container():
+        st.markdown("---")
+
+        # 手紙のスタイル付きコンテナ
+        letter_css = """
+        <style>
+        .tutorial-letter {
+            background: linear-gradient(135deg, #fff8e1 0%, #f3e5f5 100%);
+            border: 2px solid #e1bee7;
+            border-radius: 15px;
+            padding: 25px;
+            margin: 20px 0;
+            box-shadow: 0 4px 12px rgba(0,0,0,0.1);
+            font-family: 'Georgia', serif;
+            line-height: 1.8;
+            position: relative;
+        }
+
+        .tutorial-letter::before {
+            content: '💌';
+            position: absolute;
+            top: -10px;
+            left: 20px;
+            background: white;
+            padding: 5px 10px;
+            border-radius: 50%;
+            font-size: 20px;
+        }
+
+        .tutorial-letter h3 {
+            color: #7b1fa2;
+            text-align: center;
+            margin-bottom: 20px;
+            font-size: 24px;
+        }
+
+        .tutorial-notice {
+            background: rgba(255, 193, 7, 0.1);
+            border-left: 4px solid #ffc107;
+            padding: 10px 15px;
+            margin: 15px 0;
+            border-radius: 0 8px 8px 0;
+            font-size: 14px;
+            color: #856404;
+        }
+        </style>
+        """
+
+        st.markdown(letter_css, unsafe_allow_html=True)
+
+        # 手紙の内容を美しく表示
+        letter_html = f"""
+        <div class="tutorial-letter">
+            <h3>麻理からの手紙</h3>
+            <div style="white-space: pre-line; color: #424242;">
+                {tutorial_letter["content"]}
+            </div>
+        </div>
+        """
+
+        st.markdown(letter_html, unsafe_allow_html=True)
+
+        # チュートリアル用の注意書き
+        notice_html = """
+        <div class="tutorial-notice">
+            📘 これはチュートリアル用の短縮版です。好感度を上げると、もっと長い手紙も……？
+        </div>
+        """
+        st.markdown(notice_html, unsafe_allow_html=True)
+
+        # 会話に反映ボタン
+        if st.button("💬 この手紙の内容を会話に反映", key="tutorial_letter_reflect"):
+            # メモリに手紙の内容を追加
+            memory_notification = f"手紙の内容「{tutorial_letter['theme']}」について話題にしました"
+            st.session_state.memory_notifications.append(memory_notification)
+            del st.session_state.tutorial_letter
+            st.success("手紙の内容が会話に反映されました！チャットタブで確認してください。")
+            st.rerun()
+
+
+@st.fragment
 def render_letter_tab(managers):
-    """「手紙を受け取る」タブのUIを描画する"""
+    """「手紙を受け取る」タブのUIを描画する（タブ内の操作ではこのタブだけを再実行する）"""
     st.title("✉️ おやすみ前の、一通の手紙")
     
     # チュートリアル案内（ステップ4の場合のみ）
@@ -1725,52 +1990,22 @@ def render_letter_tab(managers):
     # 手紙機能のチュートリアル
     col1, col2, col3 = st.columns([1, 2, 1])
     with col2:
-        with st.expander("📝 手紙機能の使い方", expanded=False):
-            st.markdown("""
-            ### ✉️ 手紙機能について
-            麻理があなたのために、心を込めて手紙を書いてくれる特別な機能です。
-            
-            ### 📅 利用方法
-            1. **好感度を上げる**：手紙をリクエストするには好感度40以上が必要です
-            2. **テーマを入力**：手紙に書いてほしい内容やテーマを入力
-            3. **時間を選択**：手紙を書いてほしい深夜の時間を選択
-            4. **リクエスト送信**：「この内容でお願いする」ボタンを押す
-            5. **手紙を受け取り**：指定した時間に手紙が生成されます
-            6. **会話に反映**：手紙を読んだ後、「会話に反映」ボタンで麻理との会話で話題にできます
-            
-            ### 💡 テーマの例
-            - 「今日見た美しい夕日について」
-            - 「最近読んだ本の感想」
-            - 「季節の変わり目の気持ち」
-            - 「大切な人への想い」
-            - 「将来への希望や不安」
-            
-            ### ⏰ 生成時間
-            - **深夜2時〜4時**の間で選択可能
-            - 静かな夜の時間に、ゆっくりと手紙を綴ります
-            - **1日1通まで**リクエスト可能
-            
-            ### 💝 利用条件
-            - **好感度40以上**が必要です
-            - 麻理との会話を重ねて関係を深めてください
-            
-            ### 📖 手紙の確認
-            - 生成された手紙は下の「あなたへの手紙」で確認できます
-            - 過去の手紙も保存されているので、いつでも読み返せます
-            
-            ---
-            **心に残るテーマを入力して、麻理からの特別な手紙を受け取ってみてください** 💌
-            """)
+        # 開いている時だけ本文を送る（折りたたみ時にも全文を描画するexpanderの代わりにトグルを使う）
+        if st.toggle("📝 手紙機能の使い方", key="letter_tutorial_open"):
+            with st.container(border=True):
+                st.markdown(_LETTER_TUTORIAL_MD)
 
     user_id = st.session_state.user_id
-    user_manager = managers['user_manager']
-    request_manager = managers['request_manager']
 
     st.divider()
 
     # --- 手紙のリクエストフォーム ---
     st.subheader("新しい手紙をリクエストする")
     
+    # チュートリアルで生成した手紙があれば表示
+    if 'tutorial_letter' in st.session_state:
+        render_tutorial_letter(st.session_state.tutorial_letter)
+    
     # 現在の好感度を取得
     current_affection = st.session_state.chat['affection']
     required_affection = 40
@@ -1792,7 +2027,7 @@ def render_letter_tab(managers):
         st.info("📘 **チュートリアル特典**: 初回のみ好感度に関係なく手紙をリクエストできます！")
     
     try:
-        request_status = run_async(request_manager.get_user_request_status(user_id))
+        request_status = _cached_request_status(user_id, _letter_cache_rev())
     except Exception as e:
         logger.error(f"リクエスト状況取得エラー: {e}")
         request_status = {"has_request": False}
@@ -1824,8 +2059,8 @@ def render_letter_tab(managers):
                 theme = st.text_input("手紙のテーマ", placeholder="例：最近見た美しい景色について")
                 generation_hour = st.selectbox(
                     "手紙を書いてほしい時間",
-                    options=Config.BATCH_SCHEDULE_HOURS,
-                    format_func=lambda h: f"深夜 {h}時"
+                    options=list(_HOUR_LABELS),
+                    format_func=_HOUR_LABELS.__getitem__
                 )
                 submitted = st.form_submit_button("この内容でお願いする")
 
@@ -1846,94 +2081,21 @@ def render_letter_tab(managers):
                                 # チュートリアルステップ4を完了
                                 tutorial_manager.check_step_completion(4, True)
                                 
-                                # 手紙を表示
-                                st.success("✉️ 麻理からの手紙が届きました！")
-                                
-                                with st.container():
-                                    st.markdown("---")
-                                    
-                                    # 手紙のスタイル付きコンテナ
-                                    letter_css = """
-                                    <style>
-                                    .tutorial-letter {
-                                        background: linear-gradient(135deg, #fff8e1 0%, #f3e5f5 100%);
-                                        border: 2px solid #e1bee7;
-                                        border-radius: 15px;
-                                        padding: 25px;
-                                        margin: 20px 0;
-                                        box-shadow: 0 4px 12px rgba(0,0,0,0.1);
-                                        font-family: 'Georgia', serif;
-                                        line-height: 1.8;
-                                        position: relative;
-                                    }
-                                    
-                                    .tutorial-letter::before {
-                                        content: '💌';
-                                        position: absolute;
-                                        top: -10px;
-                                        left: 20px;
-                                        background: white;
-                                        padding: 5px 10px;
-                                        border-radius: 50%;
-                                        font-size: 20px;
-                                    }
-                                    
-                                    .tutorial-letter h3 {
-                                        color: #7b1fa2;
-                                        text-align: center;
-                                        margin-bottom: 20px;
-                                        font-size: 24px;
-                                    }
-                                    
-                                    .tutorial-notice {
-                                        background: rgba(255, 193, 7, 0.1);
-                                        border-left: 4px solid #ffc107;
-                                        padding: 10px 15px;
-                                        margin: 15px 0;
-                                        border-radius: 0 8px 8px 0;
-                                        font-size: 14px;
-                                        color: #856404;
-                                    }
-                                    </style>
-                                    """
-                                    
-                                    st.markdown(letter_css, unsafe_allow_html=True)
-                                    
-                                    # 手紙の内容を美しく表示
-                                    letter_html = f"""
-                                    <div class="tutorial-letter">
-                                        <h3>麻理からの手紙</h3>
-                                        <div style="white-space: pre-line; color: #424242;">
-                                            {tutorial_letter}
-                                        </div>
-                                    </div>
-                                    """
-                                    
-                                    st.markdown(letter_html, unsafe_allow_html=True)
-                                    
-                                    # チュートリアル用の注意書き
-                                    notice_html = """
-                                    <div class="tutorial-notice">
-                                        📘 これはチュートリアル用の短縮版です。好感度を上げると、もっと長い手紙も……？
-                                    </div>
-                                    """
-                                    st.markdown(notice_html, unsafe_allow_html=True)
-                                    
-                                    # 会話に反映ボタン
-                                    if st.button("💬 この手紙の内容を会話に反映", key="tutorial_letter_reflect"):
-                                        # メモリに手紙の内容を追加
-                                        memory_notification = f"手紙の内容「{theme}」について話題にしました"
-                                        st.session_state.memory_notifications.append(memory_notification)
-                                        st.success("手紙の内容が会話に反映されました！チャットタブで確認してください。")
-                                        st.rerun()
+                                # 再実行後も表示できるよう、生成した手紙をセッション状態に保存
+                                st.session_state.tutorial_letter = {"theme": theme, "content": tutorial_letter}
                                 
                             except Exception as e:
                                 logger.error(f"チュートリアル手紙生成エラー: {e}")
                                 st.error("手紙の生成に失敗しました。しばらく後でお試しください。")
+                            else:
+                                # ステップ完了をサイドバーやチャットタブの案内にも反映するため、アプリ全体を再実行する
+                                st.rerun()
                     else:
                         # 通常の手紙リクエスト処理
                         with st.spinner("リクエストを送信中..."):
                             try:
+                                # 手紙機能の管理クラスは送信時にだけ取り出す
+                                request_manager = managers['request_manager']
                                 # 好感度情報も一緒に送信
                                 success, message = run_async(
                                     request_manager.submit_request(user_id, theme, generation_hour, affection=current_affection)
@@ -1942,6 +2104,7 @@ def render_letter_tab(managers):
                                 logger.error(f"リクエスト送信エラー: {e}")
                                 success, message = False, "リクエストの送信に失敗しました。しばらく後でお試しください。"
                         if success:
+                            clear_letter_caches()
                             st.success(message)
                             st.rerun()
                         else:
@@ -1951,12 +2114,19 @@ def render_letter_tab(managers):
 
     # --- 過去の手紙一覧 ---
     st.subheader("あなたへの手紙")
-    with st.spinner("手紙の履歴を読み込んでいます..."):
+    try:
+        history = _cached_letter_history(user_id, 10, _letter_cache_rev(), _letter_status_token(request_status))
+    except Exception as e:
+        logger.error(f"手紙履歴取得エラー: {e}")
+        history = []
+    
+    # 手紙の本文はユーザーデータから取得（完了済みの手紙がある場合のみ1回だけ読み込む）
+    letter_contents = {}
+    if any(letter_info.get("status") == "completed" for letter_info in history):
         try:
-            history = run_async(user_manager.get_user_letter_history(user_id, limit=10))
+            letter_contents = _cached_letter_contents(user_id, _letter_cache_rev(), _letter_status_token(request_status))
         except Exception as e:
-            logger.error(f"手紙履歴取得エラー: {e}")
-            history = []
+            logger.error(f"ユーザーデータ取得エラー: {e}")
 
     if not history:
         st.info("まだ手紙はありません。最初の手紙をリクエストしてみましょう。")
@@ -1966,31 +2136,40 @@ def render_letter_tab(managers):
             theme = letter_info.get("theme")
             status = letter_info.get("status", "unknown")
 
-            with st.expander(f"{date} - テーマ: {theme} ({status})"):
+            # 本文は「読む」が押された手紙だけ描画する（折りたたまれた手紙のMarkdown描画を省く）
+            open_key = f"letter_open_{date}"
+            opened = st.session_state.get(open_key, False)
+
+            with st.expander(letter_info["display_title"], expanded=opened):
                 if status == "completed":
                     try:
-                        user_data = run_async(user_manager.storage.get_user_data(user_id))
-                        content = user_data.get("letters", {}).get(date, {}).get("content", "内容の取得に失敗しました。")
-                        st.markdown(content.replace("\n", "\n\n"))
+                        content = letter_contents.get(date) or "内容の取得に失敗しました。"
+                        if not opened and st.button("📖 読む", key=f"read_{date}"):
+                            st.session_state[open_key] = opened = True
+                        if opened:
+                            st.markdown(content.replace("\n", "\n\n"))
                         
                         # 手紙を会話に反映するボタン
                         col1, col2 = st.columns([3, 1])
                         with col2:
                             if st.button(f"💬 会話に反映", key=f"reflect_{date}", help="この手紙の内容を麻理との会話で話題にします"):
                                 # 手紙の内容をメモリに追加
-                                letter_summary = f"手紙のテーマ「{theme}」について麻理が書いた内容: {content[:200]}..."
+                                letter_summary = _LETTER_SUMMARY_TMPL.format(theme=theme, preview=content[:_LETTER_PREVIEW_CHARS])
                                 memory_notification = st.session_state.memory_manager.add_important_memory("letter_content", letter_summary)
                                 
-                                # 手紙について話すメッセージを自動追加
+                                # 手紙について話すメッセージと麻理の応答を生成
                                 letter_message = f"この前書いてくれた「{theme}」についての手紙、読ませてもらったよ。"
-                                st.session_state.chat['messages'].append({"role": "user", "content": letter_message})
-                                
-                                # 麻理の応答を生成
                                 response = f"あの手紙、読んでくれたんだ...。「{theme}」について書いたとき、あなたのことを思いながら一生懸命考えたんだ。どう思った？"
-                                st.session_state.chat['messages'].append({"role": "assistant", "content": response})
                                 
-                                # 特別な記憶の通知をセッション状態に保存
+                                # 会話履歴と特別な記憶の通知をまとめてセッション状態に追加
+                                st.session_state.chat['messages'].extend((
+                                    {"role": "user", "content": letter_message},
+                                    {"role": "assistant", "content": response},
+                                ))
+                                st.session_state.chat['recent_turns'].append((letter_message, response))
                                 st.session_state.memory_notifications.append(memory_notification)
+                                trim_chat_messages(st.session_state.chat['messages'])
+                                clear_letter_caches()
                                 st.success("手紙の内容が会話に反映されました！チャットタブで確認してください。")
                                 st.rerun()
                                 
@@ -2012,17 +2191,6 @@ def main():
         layout="centered", initial_sidebar_state="auto"
     )
 
-    # event loopの安全な設定
-    try:
-        # 既存のループがあるかチェック
-        asyncio.get_running_loop()
-    except RuntimeError:
-        # 実行中のループがない場合のみ新しいループを設定
-        if sys.platform.startswith('win'):
-            asyncio.set_event_loop_policy(asyncio.WindowsProactorEventLoopPolicy())
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-
     # 全ての依存モジュールを初期化
     managers = initialize_all_managers()
     
@@ -75,6 +75,7 @@ class SessionManager:
         # 検証履歴を記録
         validation_record = {
             "timestamp": validation_time.isoformat(),
+            "timestamp_epoch": validation_time.timestamp(),  # 経過時間計算用（文字列の再パースを避ける）
             "validation_count": self.validation_count,
             "original_session_id": self.session_id,
             "current_session_id": current_session_id,
@@ -120,6 +121,7 @@ class SessionManager:
         # 復旧履歴を記録
         recovery_record = {
             "timestamp": recovery_time.isoformat(),
+            "timestamp_epoch": recovery_time.timestamp(),  # 経過時間計算用（文字列の再パースを避ける）
             "recovery_count": self.recovery_count,
             "old_session_id": old_session_id,
             "new_session_id": new_session_id,
@@ -210,6 +212,9 @@ class SessionManager:
         Returns:
             Dict[str, Any]: 分離状態情報を含む辞書
         """
+        pending_memory = len(st.session_state.get('memory_notifications', []))
+        pending_affection = len(st.session_state.get('affection_notifications', []))
+        
         isolation_status = {
             "session_isolation": {
                 "session_manager_present": hasattr(st.session_state, '_session_manager'),
@@ -230,9 +235,10 @@ class SessionManager:
                 "memory_cache_size": len(getattr(st.session_state.get('memory_manager'), 'important_words_cache', [])),
                 "special_memories_count": len(getattr(st.session_state.get('memory_manager'), 'special_memories', [])),
                 "pending_notifications": {
-                    "memory": len(st.session_state.get('memory_notifications', [])),
-                    "affection": len(st.session_state.get('affection_notifications', []))
-                }
+                    "memory": pending_memory,
+                    "affection": pending_affection
+                },
+                "pending_total": pending_memory + pending_affection
             }
         }
         